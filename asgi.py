@@ -0,0 +1,1133 @@
+"""
+================================================================================
+DEVOPS LEARNING PROJECT - ASYNC (ASGI) SERVING MODE
+================================================================================
+
+The normal app (app.py) is a "sync" Flask app: while a request waits for
+PostgreSQL, the worker handling it can't do anything else. With
+gunicorn --workers 2 only 2 requests can wait on the database at once.
+
+This file serves the SAME routes in "async" mode:
+- Starlette (a small async web framework) instead of Flask
+- asyncpg (an async PostgreSQL driver) with an async connection pool
+- One worker can keep hundreds of requests waiting on the database at the
+  same time - while one waits, the others keep running
+
+Settings, JSON output, metrics, the query profiler and the background jobs
+(visit recorder, health monitor, rollups...) are shared with app.py, so
+responses look the same.
+
+Not shared: read replicas, the response cache and the user directory.
+Reads here always go to the primary, so the same URL may run different
+code in the two modes (scripts/compare_modes.py points this out).
+
+HOW TO RUN:
+- Locally:        uvicorn asgi:app --port 5000
+- With gunicorn:  SERVER_MODE=async gunicorn   (see gunicorn.conf.py)
+- Compare modes:  python scripts/compare_modes.py --help
+
+================================================================================
+"""
+
+import asyncio  # Python's built-in async toolkit
+import contextvars
+import datetime
+import functools
+import math
+import os
+import re
+import time
+import uuid
+import zlib
+
+import anyio  # Starlette's async toolkit (installed with it)
+import asyncpg  # Async PostgreSQL driver
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Match, Route
+
+import app as sync_app  # Shared settings, JSON provider and background jobs
+
+DATABASE_URL = sync_app.DATABASE_URL
+
+# ============================================================================
+# JSON RESPONSES
+# ============================================================================
+# Use the exact same JSON provider as the Flask app (orjson if installed),
+# so both modes return byte-for-byte identical JSON.
+
+
+class AppJSONResponse(Response):
+    media_type = 'application/json'
+
+    def render(self, content):
+        return (sync_app.app.json.dumps(content) + '\n').encode('utf-8')
+
+
+def json_response(content, status_code=200):
+    return AppJSONResponse(content, status_code=status_code)
+
+
+# ============================================================================
+# ASYNC CONNECTION POOL
+# ============================================================================
+# asyncpg's pool works like the one in app.py, but waiting for a free
+# connection doesn't block the worker - other requests keep running.
+# The pool is created on first use. If the database isn't up yet, requests
+# get a 503 at once and the next attempt waits DB_POOL_RETRY_MIN seconds,
+# doubling after every failure up to DB_POOL_RETRY_MAX - a database that is
+# down doesn't get a connection attempt from every request.
+#
+# Differences from app.py's pool: asyncpg closes connections that sat
+# unused for DB_POOL_MAX_IDLE seconds (an idle timeout), but has no
+# maximum age like DB_POOL_MAX_AGE - a busy connection is kept for as
+# long as it works.
+
+DB_POOL_MAX_IDLE = float(os.getenv('DB_POOL_MAX_IDLE', 300))
+DB_POOL_RETRY_MIN = float(os.getenv('DB_POOL_RETRY_MIN', 1))
+DB_POOL_RETRY_MAX = float(os.getenv('DB_POOL_RETRY_MAX', 30))
+
+db_pool = None
+db_pool_lock = asyncio.Lock()
+pool_retry = {'delay': 0.0, 'next_attempt': 0.0}  # backoff after failed attempts
+
+# asyncpg's versions of app.py's DB_CONNECTION_ERRORS: the database or the
+# connection failed (including DB_STATEMENT_TIMEOUT), not the statement
+ASYNC_CONNECTION_ERRORS = (
+    OSError, asyncio.TimeoutError, asyncpg.InterfaceError, asyncpg.PostgresConnectionError,
+    asyncpg.exceptions.OperatorInterventionError, asyncpg.TooManyConnectionsError
+)
+
+
+async def get_pool():
+    """Return the async pool, creating it if needed (None if the database is down)"""
+    global db_pool
+    if not DATABASE_URL:
+        return None
+    if db_pool is not None:
+        return db_pool
+    if time.monotonic() < pool_retry['next_attempt']:
+        return None  # the last attempt failed - wait before the next one
+    async with db_pool_lock:
+        if db_pool is None and time.monotonic() >= pool_retry['next_attempt']:
+            # First use: check (and maybe migrate) the schema, like app.py does
+            await asyncio.to_thread(sync_app.schema_migrator.ensure_current)
+            try:
+                db_pool = await asyncpg.create_pool(
+                    DATABASE_URL,
+                    min_size=sync_app.DB_POOL_MIN_SIZE,
+                    max_size=sync_app.DB_POOL_MAX_SIZE,
+                    max_inactive_connection_lifetime=DB_POOL_MAX_IDLE,
+                    # Same limits as app.py's connections
+                    timeout=sync_app.DB_CONNECT_TIMEOUT,
+                    server_settings={'statement_timeout': str(int(sync_app.DB_STATEMENT_TIMEOUT * 1000))}
+                )
+            except Exception as e:
+                delay = min(max(pool_retry['delay'] * 2, DB_POOL_RETRY_MIN), DB_POOL_RETRY_MAX)
+                pool_retry.update(delay=delay, next_attempt=time.monotonic() + delay)
+                print(f"Database connection error (next attempt in {delay:g}s): {e}")
+                sync_app.db_breaker.record_call(True)
+                return None
+            pool_retry.update(delay=0.0, next_attempt=0.0)
+    return db_pool
+
+
+class db_connection:
+    """
+    Borrow a pooled connection for an "async with" block
+
+    Usage:
+        async with db_connection() as conn:
+            if not conn:
+                return 503
+            rows = await conn.fetch(...)
+
+    Yields None if the database is unavailable, the pool is exhausted
+    for DB_POOL_TIMEOUT seconds or app.py's circuit breaker is open.
+
+    Both modes share app.py's db_breaker: every block counts as one call,
+    and every statement run through timed() as one statement.
+    """
+
+    def __init__(self):
+        self.pool = None
+        self.conn = None
+
+    async def __aenter__(self):
+        if not DATABASE_URL or not sync_app.db_breaker.allow():
+            return None
+        self.pool = await get_pool()
+        if self.pool is None:
+            return None
+        try:
+            self.conn = await self.pool.acquire(timeout=sync_app.DB_POOL_TIMEOUT)
+        except (asyncio.TimeoutError, OSError, asyncpg.PostgresError) as e:
+            print(f"Database connection error: {e}")
+            sync_app.db_breaker.record_call(True)
+            return None
+        return self.conn
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        if self.conn is not None:
+            failed = isinstance(exc, ASYNC_CONNECTION_ERRORS)
+            conn, self.conn = self.conn, None
+            await self.pool.release(conn)
+            sync_app.db_breaker.record_call(failed)
+
+
+# ----------------------------------------------------------------------------
+# QUERY PROFILING
+# ----------------------------------------------------------------------------
+# The async version of app.py's TimedCursorMixin: statements run through
+# timed() are timed, counted in GET /api/queries and logged when slow or
+# failed - tagged with the route and request ID (see REQUEST TRACKING).
+#
+# The SQL comment only names the route: asyncpg prepares every statement and
+# caches it by its text, and a request ID would make every text unique.
+
+request_route = contextvars.ContextVar('request_route', default='background')
+request_id = contextvars.ContextVar('request_id', default=None)
+
+
+def row_count(result):
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, asyncpg.Record):
+        return 1
+    return 0 if result is None else -1  # -1 = "no row count" (like psycopg2)
+
+
+async def timed(run, query, *args):
+    """
+    await run(query, *args), profiled
+
+    Usage:
+        rows = await timed(conn.fetch, "SELECT ... WHERE id > $1", after_id)
+    """
+    route = request_route.get()
+    text = query
+    if sync_app.QUERY_SQL_COMMENT:
+        query = f"/* route='{route}' */ {query}"
+    started = time.perf_counter()
+    error = result = None
+    try:
+        result = await run(query, *args)
+        return result
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        sync_app.DB_QUERY_DURATION.labels(route).observe(elapsed)
+        sync_app.record_query(text, route, request_id.get(), elapsed, row_count(result), error,
+                              connection_errors=ASYNC_CONNECTION_ERRORS,
+                              constraint_errors=asyncpg.IntegrityConstraintViolationError)
+
+
+def database_error(e):
+    """The database failed in the middle of a request: 503, try again later (like app.py)"""
+    print(f"Database error: {str(e).strip()}")
+    retry_after = math.ceil(sync_app.db_breaker.retry_after())
+    return AppJSONResponse({'error': 'Database not available', 'retry_after': retry_after},
+                           status_code=503, headers={'Retry-After': str(retry_after)})
+
+
+def pool_stats():
+    if db_pool is None:
+        return {'size': 0, 'idle': 0, 'in_use': 0, 'max_size': sync_app.DB_POOL_MAX_SIZE}
+    size = db_pool.get_size()
+    idle = db_pool.get_idle_size()
+    return {'size': size, 'idle': idle, 'in_use': size - idle, 'max_size': db_pool.get_max_size()}
+
+
+def user_columns(fields):
+    """'"id", "name"' - fields are already checked against USER_FIELDS"""
+    return ', '.join(f'"{field}"' for field in fields)
+
+
+def parse_error(e):
+    return json_response({'error': str(e)}, 400)
+
+
+# ============================================================================
+# ROUTES
+# ============================================================================
+# Same URLs and same JSON as app.py.
+
+def static_response(request, static):
+    """Serve one of app.py's pre-built StaticResponses (304 if unchanged)"""
+    body, etag, encoding = static.select(request.headers.get('accept-encoding'))
+    headers = {
+        'ETag': f'"{etag}"',
+        'Vary': 'Accept-Encoding',
+        'Cache-Control': static.cache_control()
+    }
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    if_none_match = request.headers.get('if-none-match', '')
+    if headers['ETag'] in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=static.content_type, headers=headers)
+
+
+async def home(request):
+    return static_response(request, sync_app.home_page)
+
+
+async def health(request):
+    # The database state comes from app.py's background health monitor.
+    # Its very first state() runs a (blocking) check: not on the event loop
+    db_state = await asyncio.to_thread(sync_app.health_monitor.state)
+    db_healthy = db_state['healthy']
+    circuit = sync_app.db_breaker.stats()['state']
+    return json_response({
+        'status': 'healthy' if db_healthy and circuit == 'closed' else 'degraded',
+        'database': 'connected' if db_healthy else 'disconnected',
+        'database_latency_ms': db_state['latency_ms'],
+        'database_circuit': circuit,
+        'checked_at': db_state['checked_at'],
+        'timestamp': datetime.datetime.now().isoformat()
+    })
+
+
+async def health_live(request):
+    return json_response({
+        'status': 'alive',
+        'timestamp': datetime.datetime.now().isoformat()
+    })
+
+
+async def health_ready(request):
+    ready = await asyncio.to_thread(sync_app.health_monitor.is_ready)
+    return json_response({
+        'status': 'ready' if ready else 'not_ready',
+        'database': await asyncio.to_thread(sync_app.health_monitor.state) if DATABASE_URL else 'not_configured',
+        'database_circuit': sync_app.db_breaker.stats() if DATABASE_URL else 'not_configured',
+        'schema': sync_app.schema_migrator.stats() if DATABASE_URL else 'not_configured',
+        'timestamp': datetime.datetime.now().isoformat()
+    }, 200 if ready else 503)
+
+
+async def info(request):
+    return static_response(request, sync_app.info_response)
+
+
+async def hello(request):
+    return static_response(request, sync_app.hello_response)
+
+
+async def metrics(request):
+    # In multiprocess mode this reads every worker's files: not on the event loop
+    body = await asyncio.to_thread(sync_app.metrics_text)
+    return Response(body, media_type=sync_app.CONTENT_TYPE_LATEST)
+
+
+async def query_profile(request):
+    """GET /api/queries - the query profiler shared with app.py"""
+    try:
+        # asyncpg prepares (and caches) every statement by itself
+        report = sync_app.query_profile_report(args=request.query_params, prepared_statements=True)
+    except ValueError as e:
+        return parse_error(e)
+    return json_response(report)
+
+
+async def status(request):
+    db_state = await asyncio.to_thread(sync_app.health_monitor.state)
+    uptime = time.time() - sync_app.APP_STARTED_AT
+    return json_response({
+        'status': 'running',
+        'server_mode': 'async',
+        'uptime': sync_app.format_uptime(uptime),
+        'uptime_seconds': round(uptime, 1),
+        'environment': sync_app.ENVIRONMENT,
+        'database': 'connected' if db_state['healthy'] else 'disconnected',
+        'database_health': db_state,
+        'database_circuit': sync_app.db_breaker.stats(),
+        'pool': pool_stats(),
+        'visit_recorder': sync_app.visit_recorder.stats(),
+        # Only app.py has these - async reads always go to the primary
+        'not_in_async_mode': ['read_replicas', 'response_cache', 'user_directory'],
+        'single_flight': {'users': users_flight.stats(), 'stats': stats_cache.flight.stats()},
+        'stats_stream': sync_app.stream_broadcaster.stats(),
+        'schema': sync_app.schema_migrator.stats(),
+        'startup': {
+            'import_ms': round(sync_app.IMPORT_DURATION * 1000, 1)
+        },
+        'timestamp': datetime.datetime.now().isoformat()
+    })
+
+
+# ============================================================================
+# SINGLE-FLIGHT (REQUEST COALESCING)
+# ============================================================================
+# Same idea as SINGLE-FLIGHT in app.py: identical concurrent reads share one
+# database query. The query runs as its own task, so a client that hangs up
+# doesn't cancel it for everyone else waiting on it.
+
+
+class AsyncSingleFlight:
+    """asyncio version of app.py's SingleFlight (same metrics)"""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = {}  # key -> task currently in flight
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key, func):
+        """Await func() - or an identical call already running. Returns (result, shared)"""
+        task = self.calls.get(key)
+        shared = task is not None
+        if shared:
+            self.shared += 1
+            sync_app.SINGLE_FLIGHT_CALLS.labels(self.name, 'shared').inc()
+        else:
+            task = asyncio.ensure_future(func())
+            self.calls[key] = task
+
+            def finished(_):
+                if self.calls.get(key) is task:  # not already forgotten/replaced
+                    del self.calls[key]
+
+            task.add_done_callback(finished)
+            self.leaders += 1
+            sync_app.SINGLE_FLIGHT_CALLS.labels(self.name, 'leader').inc()
+        started = time.perf_counter()
+        try:
+            return await asyncio.shield(task), shared
+        finally:
+            if shared:
+                sync_app.SINGLE_FLIGHT_WAIT.labels(self.name).observe(time.perf_counter() - started)
+
+    def forget(self):
+        """After a write: later requests must not join reads started before it"""
+        self.calls.clear()
+
+    def stats(self):
+        return {'in_flight': len(self.calls), 'leaders': self.leaders, 'shared': self.shared}
+
+
+users_flight = AsyncSingleFlight('users')
+
+
+async def get_users(request):
+    """GET /api/users - keyset pagination, like app.get_users()"""
+    args = request.query_params
+    try:
+        after_id = sync_app.parse_int_arg('after_id', 0, args=args)
+        limit = sync_app.parse_int_arg('limit', sync_app.USERS_PAGE_SIZE, minimum=1,
+                                       maximum=sync_app.USERS_MAX_PAGE_SIZE, args=args)
+        fields = sync_app.parse_fields_arg(args=args)
+    except ValueError as e:
+        return parse_error(e)
+
+    async def fetch_page():
+        async with db_connection() as conn:
+            if not conn:
+                return None
+            return await timed(
+                conn.fetch,
+                f"SELECT {user_columns(fields)} FROM users WHERE id > $1 ORDER BY id LIMIT $2",
+                after_id, limit + 1
+            )
+
+    try:
+        rows, _ = await users_flight.do(('page', after_id, limit, tuple(fields or ())), fetch_page)
+    except ASYNC_CONNECTION_ERRORS as e:
+        return database_error(e)
+    except Exception as e:
+        return json_response({
+            'error': str(e),
+            'message': 'An error occurred while fetching users'
+        }, 500)
+    if rows is None:
+        return json_response({'error': 'Database not available', 'users': []}, 503)
+
+    has_more = len(rows) > limit
+    users_list = [dict(row) for row in rows[:limit]]
+    return json_response({
+        'count': len(users_list),
+        'users': users_list,
+        'limit': limit,
+        'next_cursor': users_list[-1]['id'] if has_more else None
+    })
+
+
+async def get_user(request):
+    """GET /api/users/<id>"""
+    try:
+        fields = sync_app.parse_fields_arg(args=request.query_params)
+    except ValueError as e:
+        return parse_error(e)
+    return await fetch_one_user(fields, 'id', request.path_params['user_id'])
+
+
+async def get_user_by_email(request):
+    """GET /api/users/by-email?email=..."""
+    email = request.query_params.get('email', '').strip()
+    if not email:
+        return json_response({'error': "'email' is required"}, 400)
+    try:
+        fields = sync_app.parse_fields_arg(args=request.query_params)
+    except ValueError as e:
+        return parse_error(e)
+    return await fetch_one_user(fields, 'email', email)
+
+
+async def fetch_one_user(fields, column, value):
+    """Shared code for the single-user lookups ('id' or 'email'), like app.fetch_one_user()"""
+
+    async def fetch_user():
+        async with db_connection() as conn:
+            if not conn:
+                return False
+            return await timed(conn.fetchrow, f"SELECT {user_columns(fields)} FROM users WHERE {column} = $1", value)
+
+    try:
+        row, _ = await users_flight.do((column, value, tuple(fields or ())), fetch_user)
+    except ASYNC_CONNECTION_ERRORS as e:
+        return database_error(e)
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+    if row is False:
+        return json_response({'error': 'Database not available'}, 503)
+    if row is None:
+        return json_response({'error': 'User not found'}, 404)
+    return json_response({'user': dict(row)})
+
+
+async def search_users(request):
+    """GET /api/users/search?q=... - same parameters as app.search_users()"""
+    try:
+        text, mode, pattern, after_id, limit, fields = sync_app.parse_search_args(args=request.query_params)
+    except ValueError as e:
+        return parse_error(e)
+
+    async def fetch_matches():
+        async with db_connection() as conn:
+            if not conn:
+                return None
+            return await timed(
+                conn.fetch,
+                f"SELECT {user_columns(fields)} FROM users "
+                f"WHERE lower(name) LIKE $1 AND id > $2 ORDER BY id LIMIT $3",
+                pattern, after_id, limit + 1
+            )
+
+    try:
+        rows, _ = await users_flight.do(('search', pattern, after_id, limit, tuple(fields)), fetch_matches)
+    except ASYNC_CONNECTION_ERRORS as e:
+        return database_error(e)
+    except Exception as e:
+        return json_response({
+            'error': str(e),
+            'message': 'An error occurred while searching users'
+        }, 500)
+    if rows is None:
+        return json_response({'error': 'Database not available', 'users': []}, 503)
+
+    has_more = len(rows) > limit
+    users_list = [dict(row) for row in rows[:limit]]
+    return json_response({
+        'query': text,
+        'mode': mode,
+        'count': len(users_list),
+        'users': users_list,
+        'limit': limit,
+        'next_cursor': users_list[-1]['id'] if has_more else None
+    })
+
+
+async def users_changed():
+    """After a write: later reads must not join older ones, and the sync
+    app's cached user responses and statistics are out of date (run in a
+    thread: with Redis configured these are network calls)"""
+    users_flight.forget()
+    await asyncio.to_thread(sync_app.response_cache.bump, 'users')
+    await asyncio.to_thread(sync_app.response_cache.bump, 'stats')
+
+
+async def create_user(request):
+    """POST /api/users"""
+    try:
+        data = sync_app.app.json.loads(await request.body())
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or 'name' not in data or 'email' not in data:
+        return json_response({'error': 'Name and email are required'}, 400)
+
+    try:
+        async with db_connection() as conn:
+            if not conn:
+                return json_response({'error': 'Database not available'}, 503)
+            row = await timed(
+                conn.fetchrow,
+                "INSERT INTO users (name, email) VALUES ($1, $2) RETURNING id, name, email, created_at",
+                data['name'], data['email']
+            )
+    except asyncpg.UniqueViolationError:
+        return json_response({'error': 'Email already exists'}, 409)
+    except ASYNC_CONNECTION_ERRORS as e:
+        return database_error(e)
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+
+    await users_changed()
+    return json_response({
+        'message': 'User created successfully',
+        'user': dict(row)
+    }, 201)
+
+
+async def create_users_bulk(request):
+    """POST /api/users/bulk - same body and report as app.create_users_bulk()"""
+    mimetype = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    try:
+        rows = sync_app.read_bulk_rows(await request.body(), mimetype)
+    except ValueError as e:
+        return parse_error(e)
+    if not rows:
+        return json_response({'error': 'No users provided'}, 400)
+    if len(rows) > sync_app.BULK_MAX_ROWS:
+        return json_response({'error': f'Too many users in one request (max {sync_app.BULK_MAX_ROWS})'}, 413)
+
+    results, pending = sync_app.plan_bulk_rows(rows)
+    try:
+        async with db_connection() as conn:
+            if not conn:
+                return json_response({'error': 'Database not available'}, 503)
+            for start in range(0, len(pending), sync_app.BULK_CHUNK_SIZE):
+                chunk = pending[start:start + sync_app.BULK_CHUNK_SIZE]
+                # Two array parameters instead of 2 x N values: the statement
+                # text is the same for every chunk size, so asyncpg prepares
+                # it once. Each chunk commits on its own, like app.py.
+                created = await timed(
+                    conn.fetch,
+                    """
+                    INSERT INTO users (name, email)
+                    SELECT * FROM unnest($1::varchar[], $2::varchar[])
+                    ON CONFLICT (email) DO NOTHING
+                    RETURNING id, email
+                    """,
+                    [name for _, name, _ in chunk], [email for _, _, email in chunk]
+                )
+                if created:
+                    await users_changed()
+                sync_app.record_bulk_chunk(results, chunk, [(row['id'], row['email']) for row in created])
+    except ASYNC_CONNECTION_ERRORS as e:
+        # Sending the same rows again is safe: the ones already created
+        # come back as duplicates
+        return database_error(e)
+    except Exception as e:
+        return json_response({
+            'error': str(e),
+            'message': 'An error occurred while creating users',
+            'results': [result for result in results if result]
+        }, 500)
+
+    report, status_code = sync_app.bulk_report(results)
+    return json_response(report, status_code)
+
+
+async def gzip_stream(chunks):
+    """Async version of app.gzip_stream()"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 = gzip header
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def export_users(request):
+    """GET /api/users/export - same formats as app.export_users()"""
+    args = request.query_params
+    export_format = args.get('format', 'ndjson').lower()
+    if export_format not in sync_app.EXPORT_FORMATS:
+        return json_response({
+            'error': f"Unknown format '{export_format}'. Allowed: {', '.join(sync_app.EXPORT_FORMATS)}"
+        }, 400)
+    try:
+        fields = sync_app.parse_fields_arg(args=args)
+    except ValueError as e:
+        return parse_error(e)
+    content_type, extension, formatter = sync_app.EXPORT_FORMATS[export_format]
+
+    # Borrow a connection for the whole stream. It goes back to the pool
+    # when the stream ends, fails or the client hangs up (generate's
+    # finally) - or, if streaming never started, from the background task.
+    borrowed = db_connection()
+    conn = await borrowed.__aenter__()
+    if not conn:
+        return json_response({'error': 'Database not available'}, 503)
+
+    given_back = False
+
+    async def give_back(error=None):
+        nonlocal given_back
+        if given_back:
+            return
+        given_back = True
+        # Shielded: after a disconnect Starlette cancels the stream, and the
+        # cancellation must not interrupt handing the connection back
+        with anyio.CancelScope(shield=True):
+            await borrowed.__aexit__(type(error) if error else None, error, None)
+
+    async def generate():
+        error = None
+        try:
+            if export_format == 'csv':
+                yield sync_app.csv_header(fields)
+            # A cursor lives in a transaction: PostgreSQL keeps the result
+            # and sends it EXPORT_BATCH_SIZE rows at a time
+            async with conn.transaction():
+                cursor = await timed(conn.cursor, f"SELECT {user_columns(fields)} FROM users ORDER BY id")
+                while True:
+                    rows = await cursor.fetch(sync_app.EXPORT_BATCH_SIZE)
+                    if not rows:
+                        break
+                    yield formatter(fields, rows)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            await give_back(error)
+
+    body = generate()
+    headers = {
+        'Content-Disposition': f'attachment; filename=users.{extension}',
+        'Vary': 'Accept-Encoding',
+        'X-Accel-Buffering': 'no'
+    }
+    if 'gzip' in request.headers.get('accept-encoding', ''):
+        body = gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+    return StreamingResponse(body, headers=headers, media_type=content_type, background=BackgroundTask(give_back))
+
+
+# ----------------------------------------------------------------------------
+# STATISTICS
+# ----------------------------------------------------------------------------
+# The same stale-while-revalidate cache as app.py's StaleWhileRevalidateCache
+# (same settings, same "freshness" and weak ETag), with a background task
+# instead of a thread. User writes - here or in the sync app - bump the
+# 'stats' version of the response cache, which makes the numbers stale.
+
+
+class AsyncStaleWhileRevalidateCache:
+    """asyncio version of app.py's StaleWhileRevalidateCache"""
+
+    def __init__(self, loader, ttl=5.0, stale_ttl=60.0, name='cache', namespace=None):
+        self.loader = loader
+        self.namespace = namespace
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.flight = AsyncSingleFlight(name)  # one load at a time when empty/expired
+        self.value = None
+        self.loaded_at = None         # time.monotonic() of the last load
+        self.generated_at = None      # wall clock time of the last load
+        self.version = None           # namespace version the value was loaded at
+        self.refresh_task = None
+
+    async def _current_version(self):
+        if not self.namespace:
+            return None
+        version = functools.partial(sync_app.response_cache.version, self.namespace)
+        # A Redis round trip must not block the event loop
+        return await asyncio.to_thread(version) if sync_app.response_cache.backend is not None else version()
+
+    async def _load(self):
+        # Read the version first: a write during the load bumps it again
+        version = await self._current_version()
+        value = await self.loader()
+        self.value = value
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.generated_at = datetime.datetime.now()
+        return value
+
+    async def _refresh_in_background(self):
+        try:
+            await self._load()
+        except Exception as e:
+            print(f"Background refresh failed: {e}")
+
+    async def get(self):
+        """
+        Returns (value, generated_at, age_seconds, stale)
+        """
+        version = await self._current_version()
+        if self.loaded_at is not None:
+            age = time.monotonic() - self.loaded_at
+            if age < self.ttl and version == self.version:
+                return self.value, self.generated_at, age, False
+            if age < self.ttl + self.stale_ttl:
+                if self.refresh_task is None or self.refresh_task.done():
+                    self.refresh_task = asyncio.create_task(self._refresh_in_background())
+                return self.value, self.generated_at, age, True
+
+        # Empty or too old: wait for a fresh load, shared with any other
+        # request that is already waiting for one
+        value, _ = await self.flight.do('load', self._load)
+        return value, self.generated_at, 0.0, False
+
+    def clear(self):
+        self.loaded_at = None
+
+
+async def load_stats():
+    async with db_connection() as conn:
+        if not conn:
+            raise sync_app.DatabaseUnavailable()
+        try:
+            rows = await timed(
+                conn.fetch,
+                "SELECT name, value FROM table_counters WHERE name = ANY($1::varchar[])",
+                list(sync_app.COUNTED_TABLES)
+            )
+        except asyncpg.exceptions.UndefinedTableError:
+            rows = []  # No table_counters yet (migration 4 hasn't run)
+        totals = {row['name']: row['value'] for row in rows}
+        for table in sync_app.COUNTED_TABLES:
+            if table not in totals:
+                totals[table] = await timed(conn.fetchval, f'SELECT COUNT(*) FROM "{table}"')
+        recent = await timed(
+            conn.fetch,
+            "SELECT endpoint, visited_at FROM visits ORDER BY visited_at DESC LIMIT 10"
+        )
+    return {
+        'users': {'total': totals['users']},
+        'visits': {'total': totals['visits'], 'recent': [dict(row) for row in recent]}
+    }
+
+
+stats_cache = AsyncStaleWhileRevalidateCache(load_stats, ttl=sync_app.STATS_CACHE_TTL,
+                                             stale_ttl=sync_app.STATS_STALE_TTL, name='stats', namespace='stats')
+
+
+async def get_stats(request):
+    """GET /api/stats"""
+    try:
+        stats, generated_at, age, stale = await stats_cache.get()
+    except sync_app.DatabaseUnavailable:
+        return json_response({'error': 'Database not available', 'database_connected': False}, 503)
+    except ASYNC_CONNECTION_ERRORS as e:
+        return database_error(e)
+    except Exception as e:
+        return json_response({'error': str(e), 'database_connected': False}, 500)
+
+    # Same weak ETag as app.py: pollers that already have these numbers get a 304
+    headers = {'ETag': f'W/"stats-{generated_at.timestamp()}"', 'Cache-Control': 'no-cache'}
+    if_none_match = request.headers.get('if-none-match', '')
+    if headers['ETag'][2:] in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]:
+        return Response(status_code=304, headers=headers)
+    response = json_response({
+        'database_connected': True,
+        'users': stats['users'],
+        'visits': stats['visits'],
+        'freshness': {
+            'generated_at': generated_at.isoformat(),
+            'age_seconds': round(age, 3),
+            'stale': stale,
+            'max_age_seconds': sync_app.STATS_CACHE_TTL
+        },
+        'timestamp': datetime.datetime.now().isoformat()
+    })
+    response.headers.update(headers)
+    return response
+
+
+# ----------------------------------------------------------------------------
+# VISIT ANALYTICS
+# ----------------------------------------------------------------------------
+
+async def visit_analytics(request):
+    """GET /api/analytics/visits - read from app.py's rollup tables"""
+    try:
+        granularity, start, end, endpoint = sync_app.parse_analytics_args(args=request.query_params)
+    except ValueError as e:
+        return parse_error(e)
+
+    query = f'SELECT bucket, endpoint, count FROM "{sync_app.ROLLUP_TABLES[granularity]}" ' \
+            f'WHERE bucket >= $1 AND bucket < $2'
+    params = [start, end]
+    if endpoint:
+        query += " AND endpoint = $3"
+        params.append(endpoint)
+    query += " ORDER BY bucket, endpoint"
+    try:
+        async with db_connection() as conn:
+            if not conn:
+                return json_response({'error': 'Database not available'}, 503)
+            rows = await timed(conn.fetch, query, *params)
+            watermark = await timed(conn.fetchrow,
+                                    "SELECT last_id, updated_at FROM rollup_watermarks WHERE name = 'visits'")
+    except ASYNC_CONNECTION_ERRORS as e:
+        return database_error(e)
+    except Exception as e:
+        return json_response({'error': str(e)}, 500)
+    return json_response(sync_app.analytics_report(granularity, start, end, endpoint, rows, watermark))
+
+
+# ----------------------------------------------------------------------------
+# LIVE STATS STREAM
+# ----------------------------------------------------------------------------
+# The same Server-Sent Events stream as app.py, fed by app.py's shared
+# producer thread. Here an open stream costs no thread, only a queue, so
+# many more clients fit (ASYNC_STREAM_MAX_CLIENTS per worker).
+
+ASYNC_STREAM_MAX_CLIENTS = int(os.getenv('ASYNC_STREAM_MAX_CLIENTS', 500))
+
+
+class AsyncStreamSubscriber:
+    """Like app.py's StreamSubscriber, but wakes up the event loop instead of a thread"""
+
+    def __init__(self, size):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.size = size
+        self.closed = False
+
+    def deliver(self, message):
+        # Runs in the producer thread - only the event loop may touch the
+        # queue, so the "too slow?" check happens there too (in _put). The
+        # producer finds out on its next message.
+        if self.closed:
+            return False
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # The event loop is gone (server shutting down)
+            self.closed = True
+            return False
+        return True
+
+    def _put(self, message):
+        if self.closed:
+            return
+        if self.queue.qsize() >= self.size:
+            # The client doesn't keep up: disconnect it
+            self.closed = True
+            message = None  # wakes up messages(), which then stops
+        self.queue.put_nowait(message)
+
+    async def messages(self, heartbeat):
+        while not self.closed:
+            try:
+                message = await asyncio.wait_for(self.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                message = ': heartbeat\n\n'
+            if message is not None:
+                yield message
+
+
+async def stream_stats(request):
+    """GET /api/stats/stream"""
+    if not DATABASE_URL:
+        return json_response({'error': 'Database not available'}, 503)
+    subscriber = AsyncStreamSubscriber(sync_app.STREAM_QUEUE_SIZE)
+    broadcaster = sync_app.stream_broadcaster
+    if not broadcaster.subscribe(subscriber, ASYNC_STREAM_MAX_CLIENTS):
+        return AppJSONResponse({'error': 'Too many open streams - try again later'}, status_code=503,
+                               headers={'Retry-After': str(math.ceil(sync_app.STREAM_RETRY_MS / 1000))})
+    
+    async def generate():
+        try:
+            snapshot = await asyncio.to_thread(broadcaster.snapshot)
+            yield f'retry: {sync_app.STREAM_RETRY_MS}\n\n' + snapshot
+            async for message in subscriber.messages(sync_app.STREAM_HEARTBEAT_INTERVAL):
+                yield message
+        finally:
+            broadcaster.unsubscribe(subscriber)
+    
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+# Routes are written Flask-style ('/api/users/<int:user_id>') so visits are
+# recorded under the same names in both modes
+ROUTES = [
+    ('/', home, ['GET']),
+    ('/health', health, ['GET']),
+    ('/health/live', health_live, ['GET']),
+    ('/health/ready', health_ready, ['GET']),
+    ('/api/info', info, ['GET']),
+    ('/api/status', status, ['GET']),
+    ('/api/hello', hello, ['GET']),
+    ('/api/users', get_users, ['GET']),
+    ('/api/users', create_user, ['POST']),
+    ('/api/users/<int:user_id>', get_user, ['GET']),
+    ('/api/users/by-email', get_user_by_email, ['GET']),
+    ('/api/users/search', search_users, ['GET']),
+    ('/api/users/bulk', create_users_bulk, ['POST']),
+    ('/api/users/export', export_users, ['GET']),
+    ('/api/stats', get_stats, ['GET']),
+    ('/api/stats/stream', stream_stats, ['GET']),
+    ('/api/analytics/visits', visit_analytics, ['GET']),
+    ('/api/queries', query_profile, ['GET']),
+    ('/metrics', metrics, ['GET']),
+]
+
+
+def starlette_path(rule):
+    """'/api/users/<int:user_id>' -> '/api/users/{user_id:int}'"""
+    return re.sub(r'<(?:(\w+):)?(\w+)>', lambda m: '{%s%s}' % (m.group(2), ':' + m.group(1) if m.group(1) else ''), rule)
+
+
+# ============================================================================
+# RATE LIMITING AND LOAD SHEDDING
+# ============================================================================
+# Every route is wrapped with app.py's rate limiter and load shedder, so
+# both modes enforce the same limits (and share buckets through Redis).
+
+
+def rejection_response(request, status_code, reason, rule, message, retry_after):
+    retry_after = max(1, math.ceil(retry_after))
+    request.scope['request_rejected'] = True  # not recorded as a visit
+    sync_app.REQUESTS_REJECTED.labels(reason, rule).inc()
+    return AppJSONResponse({'error': message, 'retry_after': retry_after},
+                           status_code=status_code, headers={'Retry-After': str(retry_after)})
+
+
+def protected(rule, endpoint):
+    """Wrap an endpoint: rate limit, fail fast, then shed load (like app.py's protect_request)"""
+    if rule in sync_app.RATE_LIMIT_EXEMPT:
+        return endpoint
+
+    async def wrapper(request):
+        if sync_app.RATE_LIMIT_ENABLED:
+            client = sync_app.client_address(request.headers, request.client.host if request.client else None)
+            check = functools.partial(sync_app.rate_limiter.check, client, request.method, rule)
+            # A Redis round trip must not block the event loop
+            rejected = await asyncio.to_thread(check) if sync_app.rate_limiter.backend is not None else check()
+            if rejected is not None:
+                limit, wait = rejected
+                return rejection_response(request, 429, f'rate_limit_{limit}', rule,
+                                          'Too many requests - slow down', wait)
+        if rule in sync_app.DB_CIRCUIT_ROUTES and sync_app.db_breaker.is_open():
+            # No user directory here: every one of these routes needs the database
+            return rejection_response(request, 503, 'db_circuit_open', rule,
+                                      'Database temporarily unavailable - try again shortly',
+                                      sync_app.db_breaker.retry_after())
+        if rule in sync_app.LOAD_SHED_EXEMPT:
+            return await endpoint(request)
+        reason = sync_app.load_shedder.enter()
+        if reason is not None:
+            return rejection_response(request, 503, f'shed_{reason}', rule,
+                                      'Server is overloaded - try again shortly', sync_app.SHED_RETRY_AFTER)
+        try:
+            return await endpoint(request)
+        finally:
+            sync_app.load_shedder.leave()
+
+    return wrapper
+
+
+PROTECTED_ROUTES = [(rule, protected(rule, endpoint), methods) for rule, endpoint, methods in ROUTES]
+RULE_BY_ENDPOINT = {endpoint: rule for rule, endpoint, _ in PROTECTED_ROUTES}
+
+
+# ============================================================================
+# REQUEST TRACKING MIDDLEWARE
+# ============================================================================
+# Does what app.py's before/after_request hooks do, for every request:
+# - Gives it a request ID (X-Request-ID, kept if the client sent a valid
+#   one) and remembers its route, for the query profiler
+# - Counts it in the HTTP metrics, labelled with the route PATTERN
+#   ('unmatched' for unknown URLs)
+# - Records the visit with app.py's visit recorder (the same buffered,
+#   batched writer the sync app uses)
+
+
+def match_rule(scope):
+    """The Flask-style rule this request is routed to (None if no route matches)"""
+    for route in starlette_app.routes:
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            return RULE_BY_ENDPOINT.get(child_scope['endpoint'])
+    return None
+
+
+class RequestTrackingMiddleware:
+    def __init__(self, asgi_app):
+        self.app = asgi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        rule = match_rule(scope)
+        route = rule or 'unmatched'
+        method = scope['method']
+        incoming = dict(scope['headers']).get(b'x-request-id', b'').decode('latin-1')
+        this_request = incoming if sync_app.REQUEST_ID_PATTERN.fullmatch(incoming) else uuid.uuid4().hex
+        route_token = request_route.set(route)
+        id_token = request_id.set(this_request)
+
+        started = time.perf_counter()
+        in_progress = sync_app.HTTP_REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        finished = False
+
+        def finish(status_code):
+            nonlocal finished
+            if not finished:
+                finished = True
+                in_progress.dec()
+                sync_app.HTTP_REQUESTS.labels(method, route, str(status_code)).inc()
+                sync_app.HTTP_REQUEST_DURATION.labels(method, route).observe(time.perf_counter() - started)
+
+        async def send_tracked(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', [])) + [(b'x-request-id', this_request.encode())]
+                finish(message['status'])  # like Flask: streams count until the headers are sent
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_tracked)
+        finally:
+            finish(500)  # failed before sending a response
+            request_route.reset(route_token)
+            request_id.reset(id_token)
+
+        if DATABASE_URL and rule is not None and not scope.get('request_rejected') \
+                and rule not in sync_app.VISITS_SKIP_ENDPOINTS:
+            sync_app.visit_recorder.record(rule)
+
+
+# ============================================================================
+# APPLICATION
+# ============================================================================
+
+# Keeps a reference to fire-and-forget tasks (asyncio only keeps weak ones)
+background_checks = set()
+
+
+async def startup():
+    # Background jobs (health monitor, rollups, partitions) from app.py.
+    # Nothing here waits for the database: the pool is created on first use
+    # and the first health check runs in the background.
+    if DATABASE_URL:
+        for task in sync_app.background_tasks.values():
+            task.ensure_started()
+        task = asyncio.create_task(asyncio.to_thread(sync_app.health_monitor.check))
+        background_checks.add(task)
+        task.add_done_callback(background_checks.discard)
+
+
+async def shutdown():
+    if db_pool is not None:
+        await db_pool.close()
+
+
+starlette_app = Starlette(
+    routes=[Route(starlette_path(rule), endpoint, methods=methods) for rule, endpoint, methods in PROTECTED_ROUTES],
+    on_startup=[startup],
+    on_shutdown=[shutdown]
+)
+
+app = RequestTrackingMiddleware(starlette_app)
@@ -0,0 +1,85 @@
+# ============================================================================
+# GUNICORN CONFIGURATION
+# ============================================================================
+# Gunicorn automatically loads ./gunicorn.conf.py when it starts.
+# Command line options (like in the Dockerfile CMD) still work and override
+# anything set here.
+#
+# This file adds "server hooks" - functions gunicorn calls at certain moments
+# in the life of the server and its worker processes.
+# ============================================================================
+
+import os
+import shutil
+import subprocess
+import sys
+
+# ----------------------------------------------------------------------------
+# SERVER MODE: sync (Flask, app.py) or async (Starlette + asyncpg, asgi.py)
+# ----------------------------------------------------------------------------
+# SERVER_MODE=sync  -> classic gunicorn workers running the Flask app
+# SERVER_MODE=async -> uvicorn workers running the async app; each worker
+#                      can wait on the database for many requests at once
+
+SERVER_MODE = os.getenv('SERVER_MODE', 'sync')
+
+if SERVER_MODE == 'async':
+    wsgi_app = 'asgi:app'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+elif SERVER_MODE == 'sync':
+    wsgi_app = 'app:app'
+    # Threads per worker (more than 1 = gunicorn's threaded "gthread"
+    # worker). A slow request - or an open /api/stats/stream - then only
+    # ties up one thread instead of the whole worker
+    threads = int(os.getenv('GUNICORN_THREADS', 8))
+else:
+    raise ValueError("SERVER_MODE must be 'sync' or 'async'")
+
+# ----------------------------------------------------------------------------
+# PROMETHEUS MULTIPROCESS MODE
+# ----------------------------------------------------------------------------
+# With PROMETHEUS_MULTIPROC_DIR set, every worker writes its metrics to
+# files in that directory and /metrics adds them up (see app.py).
+# The directory must be emptied when the server starts, and a dead worker's
+# files must be marked so its "live" gauges stop being counted.
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+
+# ----------------------------------------------------------------------------
+# DATABASE MIGRATIONS
+# ----------------------------------------------------------------------------
+# Migrations run ONCE per deployment, here in the master process, instead of
+# in every worker (see SCHEMA MIGRATIONS in app.py). They run in a separate
+# process so the master never imports app.py or opens database connections
+# that forked workers would inherit.
+# If this fails (database down?) the server still starts: workers retry
+# the migrations the first time they use the database.
+
+DATABASE_URL = os.getenv('DATABASE_URL')
+MIGRATE_ON_STARTUP = os.getenv('MIGRATE_ON_STARTUP', 'true').lower() in ('1', 'true', 'yes')
+
+
+def run_migrations(server):
+    # Without PROMETHEUS_MULTIPROC_DIR, so this short-lived process leaves
+    # no metric files behind
+    env = {name: value for name, value in os.environ.items() if name != 'PROMETHEUS_MULTIPROC_DIR'}
+    result = subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'migrate'], env=env)
+    if result.returncode != 0:
+        server.log.warning("Migrations failed (exit code %s) - workers will retry", result.returncode)
+
+
+def on_starting(server):
+    """Runs once in the master process, before any worker starts"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+        os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+    if DATABASE_URL and MIGRATE_ON_STARTUP:
+        run_migrations(server)
+
+
+def child_exit(server, worker):
+    """Runs in the master process when a worker exits"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+============================================================================
+SYNC vs ASYNC COMPARISON BENCHMARK
+============================================================================
+Sends the same load to the sync app (Flask, app.py) and the async app
+(Starlette + asyncpg, asgi.py) and compares requests/sec and latency.
+
+Start both versions first, for example:
+  gunicorn --bind 0.0.0.0:5001 --workers 2                   (sync)
+  SERVER_MODE=async gunicorn --bind 0.0.0.0:5002 --workers 2  (async)
+
+Then run:
+  python scripts/compare_modes.py --sync-url http://localhost:5001 \
+      --async-url http://localhost:5002 --concurrency 200 --duration 15
+
+Uses the load generator from scripts/benchmark.py (standard library only).
+
+The URLs are the same, but not all the code behind them: app.py may answer
+from its response cache, user directory or a read replica, while asgi.py
+always asks the primary. Rows marked * run different code paths (see the
+notes printed at the end).
+============================================================================
+"""
+
+import argparse
+import json
+
+from benchmark import run_load
+
+DEFAULT_PATHS = '/health,/api/users?limit=50,/api/users/1,/api/stats'
+
+# Path prefix -> what the sync app does that the async app doesn't
+DIFFERENCES = {
+    '/api/users': 'sync may answer from the response cache, the user directory or a read replica; '
+                  'async always queries the primary',
+    '/api/stats': 'both use a stale-while-revalidate cache; sync may read from a replica, '
+                  'async reads the primary',
+    '/api/analytics': 'sync may read from a replica; async reads the primary',
+}
+
+
+def difference(path):
+    for prefix, note in DIFFERENCES.items():
+        if path.split('?')[0].startswith(prefix):
+            return note
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the sync and async serving modes')
+    parser.add_argument('--sync-url', default='http://localhost:5001')
+    parser.add_argument('--async-url', default='http://localhost:5002')
+    parser.add_argument('--paths', default=DEFAULT_PATHS, help='Comma separated paths to test')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per path and mode')
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = {'concurrency': args.concurrency, 'duration': args.duration, 'paths': []}
+    print(f"{'path':<28} {'mode':<6} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>8}")
+    notes = {}
+    for path in args.paths.split(','):
+        row = {'path': path}
+        note = difference(path)
+        if note:
+            row['difference'] = notes[path] = note
+        label = path + (' *' if note else '')
+        for mode, url in (('sync', args.sync_url), ('async', args.async_url)):
+            result = run_load(url, lambda: ('GET', path, None), args.concurrency, args.duration)
+            row[mode] = result
+            print(f"{label:<28} {mode:<6} {result['requests_per_second']:>9} "
+                  f"{result['p50_ms'] or '-':>9} {result['p99_ms'] or '-':>9} {result['error_rate']:>8.2%}")
+        if row['sync']['requests_per_second']:
+            row['async_speedup'] = round(row['async']['requests_per_second'] / row['sync']['requests_per_second'], 2)
+        results['paths'].append(row)
+
+    for path, note in notes.items():
+        print(f"* {path}: {note}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
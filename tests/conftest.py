@@ -0,0 +1,170 @@
+"""
+Shared test helpers: a fake PostgreSQL database
+
+FakeDatabase answers SQL from rules added with db.on(text, rows): the
+newest rule whose text appears in the statement wins. Every statement is
+remembered in db.queries, so tests can check what was sent.
+
+    def test_something(fake_db):
+        fake_db.on('FROM users', [{'id': 1, 'name': 'Ann'}])
+        response = app.app.test_client().get('/api/users')
+
+rows may also be a function (called with the query parameters) or an
+exception instance (raised by execute).
+"""
+
+import pytest
+from psycopg2 import sql
+
+import app
+
+
+def render(query):
+    """SQL text of a statement - psycopg2.sql objects need a real connection for this"""
+    if isinstance(query, sql.Composed):
+        return ''.join(render(part) for part in query.seq)
+    if isinstance(query, sql.Identifier):
+        return '.'.join(f'"{name}"' for name in query.strings)
+    if isinstance(query, sql.Literal):
+        return repr(query.wrapped)
+    if isinstance(query, sql.SQL):
+        return query.string
+    if isinstance(query, bytes):
+        return query.decode()
+    return query
+
+
+class FakeCursor:
+    def __init__(self, db, name=None, dict_rows=False):
+        self.db = db
+        self.name = name
+        self.dict_rows = dict_rows
+        self.rows = []
+        self.rowcount = -1
+        self.itersize = 2000
+        self.connection = db.connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        text = ' '.join(render(query).split())
+        self.db.queries.append((text, params))
+        rows = self.db.answer(text, params)
+        if isinstance(rows, Exception):
+            raise rows
+        self.rows = [self._shape(row) for row in rows]
+        self.rowcount = len(self.rows)
+
+    def _shape(self, row):
+        if isinstance(row, dict) and not self.dict_rows:
+            return tuple(row.values())
+        return row
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchmany(self, size=None):
+        size = size or self.itersize
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+        self.closed = False
+        self.autocommit = False
+        self.notifies = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self, name=None, cursor_factory=None):
+        return FakeCursor(self.db, name=name, dict_rows=cursor_factory is not None)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+    def get_transaction_status(self):
+        return app.TRANSACTION_STATUS_IDLE
+
+
+class FakeDatabase:
+    """Also the pool: checkout() always hands out the same connection"""
+
+    waiting = 0
+
+    def __init__(self):
+        self.rules = []
+        self.queries = []
+        self.connection = FakeConnection(self)
+        self.available = True
+        self.checked_out = 0  # connections borrowed and not given back yet
+
+    def on(self, text, rows):
+        self.rules.insert(0, (text, rows))
+
+    def answer(self, text, params):
+        for rule_text, rows in self.rules:
+            if rule_text in text:
+                return rows(params) if callable(rows) else rows
+        return []
+
+    def statements(self, text):
+        """The statements sent so far that contain 'text'"""
+        return [(query, params) for query, params in self.queries if text in query]
+
+    # ConnectionPool methods used by get_db_connection()
+    def checkout(self):
+        if not self.available:
+            return None
+        self.checked_out += 1
+        return self.connection
+
+    def checkin(self, conn, broken=False):
+        self.checked_out -= 1
+
+    def record_wait(self, seconds):
+        pass
+
+    def recent_wait(self):
+        return 0.0
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """Point the app at a FakeDatabase, with fresh caches and no background threads"""
+    db = FakeDatabase()
+    monkeypatch.setattr(app, 'DATABASE_URL', 'postgresql://test@localhost/test')
+    monkeypatch.setattr(app, 'db_pool', db)
+    monkeypatch.setattr(app, 'db_breaker', app.CircuitBreaker(enabled=False))
+    monkeypatch.setattr(app, 'background_tasks', {})
+    monkeypatch.setattr(app, 'RATE_LIMIT_ENABLED', False)
+    monkeypatch.setattr(app, 'response_cache', app.ResponseCache())
+    monkeypatch.setattr(app.schema_migrator, 'ensure_current', lambda: None)
+    monkeypatch.setattr(app.visit_recorder, 'record', lambda endpoint: None)
+    return db
+
+
+@pytest.fixture
+def client(fake_db):
+    return app.app.test_client()
@@ -0,0 +1,238 @@
+"""
+Tests for the async mode (asgi.py), driven straight through its ASGI app
+
+The FakeDatabase of conftest.py answers the statements here too: asyncpg's
+fetch/fetchrow/fetchval are mapped onto its rules.
+"""
+
+import asyncio
+import contextlib
+import datetime
+import gzip
+import json
+
+import pytest
+
+import app
+import asgi
+
+ANN = {'id': 1, 'name': 'Ann', 'email': 'ann@example.com', 'created_at': None}
+
+
+class FakeAsyncCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def fetch(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+class FakeAsyncConnection:
+    """The asyncpg methods asgi.py uses, answered by a FakeDatabase"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def _run(self, query, args):
+        text = ' '.join(query.split())
+        self.db.queries.append((text, args))
+        rows = self.db.answer(text, args)
+        if isinstance(rows, Exception):
+            raise rows
+        return list(rows)
+
+    async def fetch(self, query, *args):
+        return self._run(query, args)
+
+    async def fetchrow(self, query, *args):
+        rows = self._run(query, args)
+        return rows[0] if rows else None
+
+    async def fetchval(self, query, *args):
+        rows = self._run(query, args)
+        return next(iter(rows[0].values())) if rows else None
+
+    async def cursor(self, query, *args):
+        return FakeAsyncCursor([tuple(row.values()) for row in self._run(query, args)])
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        yield
+
+
+@pytest.fixture
+def async_db(fake_db, monkeypatch):
+    """fake_db for asgi.py: every db_connection() block borrows one fake connection"""
+    conn = FakeAsyncConnection(fake_db)
+
+    class fake_connection:
+        async def __aenter__(self):
+            if not fake_db.available:
+                return None
+            fake_db.checked_out += 1
+            return conn
+
+        async def __aexit__(self, *exc):
+            fake_db.checked_out -= 1
+
+    monkeypatch.setattr(asgi, 'db_connection', fake_connection)
+    monkeypatch.setattr(asgi, 'stats_cache', asgi.AsyncStaleWhileRevalidateCache(
+        asgi.load_stats, ttl=5, stale_ttl=60, name='stats', namespace='stats'))
+    return fake_db
+
+
+class Result:
+    def __init__(self, status, headers, body):
+        self.status_code = status
+        self.headers = headers
+        self.data = body
+
+    def get_json(self):
+        return json.loads(self.data)
+
+
+def call(path, method='GET', body=b'', headers=None):
+    """Send one request through asgi.app and collect the response"""
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+        'client': ('127.0.0.1', 50000), 'server': ('testserver', 80)
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(3600)  # no disconnect while the response is sent
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        await asgi.app(scope, receive, send)
+        await asyncio.sleep(0)  # let background refreshes start
+
+    asyncio.run(run())
+    start = sent[0]
+    headers = {name.decode(): value.decode() for name, value in start['headers']}
+    return Result(start['status'], headers, b''.join(message.get('body', b'') for message in sent[1:]))
+
+
+def test_every_sync_route_is_served():
+    sync_rules = {(rule.rule, method) for rule in app.app.url_map.iter_rules() if rule.endpoint != 'static'
+                  for method in rule.methods - {'HEAD', 'OPTIONS'}}
+    async_rules = {(rule, method) for rule, _, methods in asgi.ROUTES for method in methods}
+    assert async_rules == sync_rules
+
+
+def test_request_metrics_and_id(async_db):
+    async_db.on('FROM users', [ANN])
+    labels = {'method': 'GET', 'route': '/api/users/<int:user_id>'}
+    before = app.REGISTRY.get_sample_value('http_requests_total', dict(labels, status='200')) or 0
+    response = call('/api/users/1', headers={'X-Request-ID': 'abc-123'})
+    assert response.get_json() == {'user': ANN}
+    assert response.headers['x-request-id'] == 'abc-123'
+    assert app.REGISTRY.get_sample_value('http_requests_total', dict(labels, status='200')) == before + 1
+    assert app.REGISTRY.get_sample_value('http_requests_in_progress', labels) == 0
+    metrics = call('/metrics')
+    assert metrics.headers['content-type'].startswith('text/plain')
+    assert b'http_requests_total' in metrics.data
+
+
+def test_unknown_urls_share_one_label(async_db):
+    labels = {'method': 'GET', 'route': 'unmatched', 'status': '404'}
+    before = app.REGISTRY.get_sample_value('http_requests_total', labels) or 0
+    assert call('/no/such/page').status_code == 404
+    assert app.REGISTRY.get_sample_value('http_requests_total', labels) == before + 1
+
+
+def test_queries_are_profiled_by_route(async_db, monkeypatch):
+    monkeypatch.setattr(app, 'query_stats', app.QueryStats(10))
+    call('/api/users/by-email?email=ann@example.com')
+    [(query, params)] = async_db.statements('FROM users')
+    assert query.startswith("/* route='/api/users/by-email' */ SELECT")  # no request id
+    assert params == ('ann@example.com',)
+    [entry] = call('/api/queries').get_json()['queries']
+    assert entry['routes'] == ['/api/users/by-email'] and entry['calls'] == 1
+
+
+def test_by_email_and_search(async_db):
+    async_db.on('FROM users', [ANN])
+    assert call('/api/users/by-email').status_code == 400
+    data = call('/api/users/search?q=AN&limit=1').get_json()
+    assert data['query'] == 'an' and data['users'] == [ANN]
+    [(query, params)] = async_db.statements('lower(name) LIKE')
+    assert 'lower(name) LIKE $1 AND id > $2 ORDER BY id LIMIT $3' in query
+    assert params == ('an%', 0, 2)
+    assert call('/api/users/search?q=jo&mode=fuzzy').get_json()['error'] == "'mode' must be prefix or contains"
+
+
+def test_bulk_create(async_db):
+    async_db.on('INSERT INTO users', [{'id': 5, 'email': 'a@example.com'}])
+    body = json.dumps([{'name': 'A', 'email': 'a@example.com'}, {'name': 'B', 'email': 'b@example.com'}])
+    response = call('/api/users/bulk', 'POST', body.encode(), {'Content-Type': 'application/json'})
+    report = response.get_json()
+    assert [result['status'] for result in report['results']] == ['created', 'duplicate']
+    [(query, params)] = async_db.statements('INSERT INTO users')
+    assert 'unnest($1::varchar[], $2::varchar[])' in query
+    assert params == (['A', 'B'], ['a@example.com', 'b@example.com'])
+    assert app.response_cache.version('users') == 1
+
+
+def test_gzip_csv_export_gives_the_connection_back(async_db):
+    async_db.on('FROM users', [{'id': 1, 'name': 'Ann'}, {'id': 2, 'name': 'Bob'}])
+    response = call('/api/users/export?format=csv&fields=name', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['content-encoding'] == 'gzip'
+    assert gzip.decompress(response.data).decode().splitlines() == ['id,name', '1,Ann', '2,Bob']
+    assert async_db.checked_out == 0
+
+
+def test_visit_analytics(async_db):
+    bucket = datetime.datetime(2025, 1, 31, 10, 0)
+    async_db.on('FROM "visits_rollup_minute"', [(bucket, '/api/users', 3)])  # Records unpack like tuples
+    response = call('/api/analytics/visits?start=2025-01-31T09:00:00&end=2025-01-31T11:00:00')
+    assert response.get_json()['points'] == [{'bucket': '2025-01-31T10:00:00', 'endpoint': '/api/users', 'count': 3}]
+    assert call('/api/analytics/visits?granularity=week').status_code == 400
+
+
+def test_stats_etag_and_stale_while_revalidate(async_db):
+    async_db.on('FROM table_counters', [{'name': 'users', 'value': 3}, {'name': 'visits', 'value': 40}])
+    first = call('/api/stats')
+    assert first.get_json()['users'] == {'total': 3}
+    assert first.headers['etag'].startswith('W/"stats-')
+    assert call('/api/stats', headers={'If-None-Match': first.headers['etag']}).status_code == 304
+
+    app.response_cache.bump('stats')  # a user was created
+    assert call('/api/stats').get_json()['freshness']['stale'] is True
+    assert len(async_db.statements('FROM table_counters')) == 2  # reloaded in the background
+
+
+def test_stats_without_a_database(async_db):
+    async_db.available = False
+    assert call('/api/stats').status_code == 503
+
+
+def test_pool_backs_off_after_a_failure(monkeypatch):
+    attempts = []
+
+    async def create_pool(*args, **kwargs):
+        attempts.append(1)
+        raise OSError('connection refused')
+
+    monkeypatch.setattr(asgi, 'DATABASE_URL', 'postgresql://test@localhost/test')
+    monkeypatch.setattr(asgi, 'db_pool', None)
+    monkeypatch.setattr(asgi, 'pool_retry', {'delay': 0.0, 'next_attempt': 0.0})
+    monkeypatch.setattr(asgi.asyncpg, 'create_pool', create_pool)
+    monkeypatch.setattr(app.schema_migrator, 'ensure_current', lambda: None)
+    monkeypatch.setattr(app, 'db_breaker', app.CircuitBreaker(enabled=False))
+
+    async def twice():
+        return await asgi.get_pool(), await asgi.get_pool()
+
+    assert asyncio.run(twice()) == (None, None)
+    assert len(attempts) == 1  # the second call waits for the retry time
+    assert asgi.pool_retry['delay'] == asgi.DB_POOL_RETRY_MIN
@@ -0,0 +1,93 @@
+"""
+Tests for the load-test / benchmark suite (scripts/benchmark.py)
+
+run_load() is pointed at a tiny HTTP server in a thread - no app and no
+database needed.
+"""
+
+import http.server
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+import benchmark  # noqa: E402
+
+
+def route(name, rps=100.0, p95=10.0, p99=20.0, errors=0.0):
+    return {'name': name, 'requests_per_second': rps, 'p95_ms': p95, 'p99_ms': p99, 'error_rate': errors}
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert benchmark.percentile(values, 0.5) == 51
+    assert benchmark.percentile(values, 0.99) == 99
+    assert benchmark.percentile(values, 1.0) == 100
+    assert benchmark.percentile([], 0.5) is None
+
+
+def test_route_requests_fill_in_the_placeholders():
+    make_request = benchmark.route_requests(
+        'POST', '/api/users/{user_id}', '{{"email": "load-{run}-{n}@example.com"}}', 5, 'run1'
+    )
+    method, path, body = make_request()
+    assert method == 'POST'
+    assert path.rsplit('/', 1)[1] in {'1', '2', '3', '4', '5'}
+    assert body == '{"email": "load-run1-1@example.com"}'
+    assert make_request()[2] == '{"email": "load-run1-2@example.com"}'  # unique per request
+
+
+def test_no_regressions_within_the_margin():
+    baseline = {'routes': [route('users', rps=100, p95=10, p99=20)]}
+    results = {'routes': [route('users', rps=85, p95=11.5, p99=23), route('new_route')]}
+    assert benchmark.compare_to_baseline(results, baseline, 0.2, 0.01) == []
+
+
+def test_regressions_are_reported():
+    baseline = {'routes': [route('users', rps=100, p95=10, p99=20, errors=0.0)]}
+    results = {'routes': [route('users', rps=70, p95=15, p99=20, errors=0.05)]}
+    problems = benchmark.compare_to_baseline(results, baseline, 0.2, 0.01)
+    assert len(problems) == 3
+    assert problems[0].startswith('users: 70 req/s')
+    assert 'p95_ms' in problems[1]
+    assert 'error rate' in problems[2]
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the app
+
+    def do_GET(self):
+        status = 500 if self.path == '/broken' else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_run_load_measures_throughput_and_latency(server):
+    result = benchmark.run_load(server, lambda: ('GET', '/', None), concurrency=2, duration=0.2)
+    assert result['requests'] > 0
+    assert result['error_rate'] == 0.0
+    assert result['p50_ms'] <= result['p95_ms'] <= result['p99_ms']
+
+
+def test_run_load_counts_errors(server):
+    result = benchmark.run_load(server, lambda: ('GET', '/broken', None), concurrency=1, duration=0.1)
+    assert result['requests'] > 0
+    assert result['error_rate'] == 1.0
+    assert result['p50_ms'] is None
@@ -0,0 +1,104 @@
+"""
+Tests for POST /api/users/bulk (see BULK CREATE: MANY USERS IN ONE REQUEST in app.py)
+
+execute_values() needs a real psycopg2 cursor, so it is replaced by a fake
+that behaves like INSERT ... ON CONFLICT (email) DO NOTHING RETURNING id, email.
+"""
+
+import json
+
+import pytest
+
+import app
+
+
+class FakeUsersTable:
+    def __init__(self, existing=()):
+        self.emails = set(existing)
+        self.next_id = 100
+        self.statements = []  # rows per INSERT statement
+
+    def execute_values(self, cursor, query, rows, page_size=None, fetch=False):
+        assert 'ON CONFLICT (email) DO NOTHING' in query
+        self.statements.append(list(rows))
+        created = []
+        for name, email in rows:
+            if email not in self.emails:
+                self.emails.add(email)
+                self.next_id += 1
+                created.append((self.next_id, email))
+        return created
+
+
+@pytest.fixture
+def users_table(fake_db, monkeypatch):
+    table = FakeUsersTable(existing={'old@example.com'})
+    monkeypatch.setattr(app, 'execute_values', table.execute_values)
+    return table
+
+
+def test_every_row_gets_a_result_in_input_order(client, users_table):
+    response = client.post('/api/users/bulk', json=[
+        {'name': 'Ann', 'email': 'ann@example.com'},
+        {'name': 'Old', 'email': 'old@example.com'},    # already in the table
+        {'name': 'Ann again', 'email': 'ann@example.com'},  # twice in this request
+        {'name': '', 'email': 'nobody@example.com'},
+        'not an object',
+    ])
+    assert response.status_code == 201
+    data = response.get_json()
+    assert data['summary'] == {'created': 1, 'duplicate': 2, 'invalid': 2}
+    assert [result['status'] for result in data['results']] == \
+        ['created', 'duplicate', 'duplicate', 'invalid', 'invalid']
+    assert data['results'][0]['id'] == 101
+    assert users_table.statements == [[('Ann', 'ann@example.com'), ('Old', 'old@example.com')]]
+
+
+def test_rows_are_inserted_in_chunks(client, users_table, fake_db, monkeypatch):
+    monkeypatch.setattr(app, 'BULK_CHUNK_SIZE', 2)
+    rows = [{'name': f'User {i}', 'email': f'user{i}@example.com'} for i in range(5)]
+    response = client.post('/api/users/bulk', json=rows)
+    assert response.get_json()['summary']['created'] == 5
+    assert [len(statement) for statement in users_table.statements] == [2, 2, 1]
+    assert fake_db.connection.commits == 3  # one per chunk
+
+
+def test_nothing_new_is_200(client, users_table):
+    response = client.post('/api/users/bulk', json=[{'name': 'Old', 'email': 'old@example.com'}])
+    assert response.status_code == 200
+
+
+def test_ndjson_body(client, users_table):
+    body = '\n'.join(json.dumps({'name': f'User {i}', 'email': f'u{i}@example.com'}) for i in range(3))
+    response = client.post('/api/users/bulk', data=body + '\n\n', content_type='application/x-ndjson')
+    assert response.get_json()['summary']['created'] == 3
+
+
+@pytest.mark.parametrize('body, content_type, status', [
+    ('{"name": "Ann"}', 'application/json', 400),      # not an array
+    ('[]', 'application/json', 400),
+    ('{"name": "Ann"\nnot json', 'application/x-ndjson', 400),
+])
+def test_bad_bodies(client, users_table, body, content_type, status):
+    assert client.post('/api/users/bulk', data=body, content_type=content_type).status_code == status
+    assert users_table.statements == []
+
+
+def test_too_many_rows(client, users_table, monkeypatch):
+    monkeypatch.setattr(app, 'BULK_MAX_ROWS', 2)
+    rows = [{'name': 'A', 'email': f'a{i}@example.com'} for i in range(3)]
+    assert client.post('/api/users/bulk', json=rows).status_code == 413
+
+
+@pytest.mark.parametrize('row, error', [
+    ({'name': 'Ann'}, 'A valid email is required'),
+    ({'name': 'Ann', 'email': 'no-at-sign'}, 'A valid email is required'),
+    ({'name': 'x' * 101, 'email': 'a@example.com'}, 'Name is longer than 100 characters'),
+])
+def test_validate_user_row(row, error):
+    with pytest.raises(ValueError, match=error):
+        app.validate_user_row(row)
+
+
+def test_validate_user_row_strips_spaces():
+    assert app.validate_user_row({'name': ' Ann ', 'email': ' ann@example.com '}) == ('Ann', 'ann@example.com')
@@ -0,0 +1,161 @@
+"""
+Tests for the database circuit breaker (see DATABASE CIRCUIT BREAKER in app.py)
+
+Run them with: make test  (or: python -m pytest tests/)
+No database is needed - failing connections are simulated.
+"""
+
+import time
+
+import psycopg2
+import pytest
+
+import app
+
+
+def make_breaker(**settings):
+    options = dict(window=10, min_calls=4, failure_rate=0.5, slow_seconds=1.0,
+                   slow_rate=0.8, open_seconds=0.05, trial_calls=2)
+    options.update(settings)
+    return app.CircuitBreaker(**options)
+
+
+def test_opens_when_half_the_calls_fail():
+    breaker = make_breaker()
+    for failed in (False, True, False):
+        breaker.record_call(failed)
+    assert breaker.state == 'closed'  # not enough calls yet
+    breaker.record_call(True)
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+    assert breaker.stats()['rejected_calls'] == 1
+
+
+def test_opens_when_statements_fail():
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_statement(0.01, failed=True)
+    assert breaker.state == 'open'
+    assert 'statements failed' in breaker.reason
+
+
+def test_opens_when_statements_are_slow():
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_statement(2.0)
+    assert breaker.state == 'open'
+
+
+def test_fast_statements_keep_it_closed():
+    breaker = make_breaker()
+    for _ in range(20):
+        breaker.record_statement(0.01)
+        breaker.record_call(False)
+    assert breaker.state == 'closed'
+
+
+def test_half_open_lets_a_few_trials_through_then_closes():
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_call(True)
+    time.sleep(0.06)
+    assert breaker.allow() and breaker.allow()
+    assert breaker.state == 'half_open'
+    assert not breaker.allow()  # only trial_calls at a time
+    assert breaker.is_open()
+    breaker.record_call(False)
+    breaker.record_call(False)
+    assert breaker.state == 'closed'
+    assert breaker.allow()
+
+
+def test_failed_trial_opens_it_again():
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_call(True)
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_call(True)
+    assert breaker.state == 'open'
+    assert breaker.stats()['times_opened'] == 2
+
+
+def test_disabled_breaker_always_allows():
+    breaker = make_breaker(enabled=False)
+    for _ in range(10):
+        breaker.record_call(True)
+    assert breaker.allow()
+    assert not breaker.is_open()
+
+
+# ----------------------------------------------------------------------------
+# Through the app: a database whose statements fail
+# ----------------------------------------------------------------------------
+
+class FailingCursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, *args):
+        raise psycopg2.OperationalError('server closed the connection unexpectedly')
+
+
+class FailingConnection:
+    closed = False
+    prepared = set()
+
+    def cursor(self, *args, **kwargs):
+        return FailingCursor()
+
+
+class FakePool:
+    waiting = 0
+
+    def __init__(self):
+        self.broken = 0
+
+    def recent_wait(self):
+        return 0.0
+
+    def checkout(self):
+        return FailingConnection()
+
+    def checkin(self, conn, broken=False):
+        self.broken += broken
+
+    def record_wait(self, seconds):
+        pass
+
+
+@pytest.fixture
+def failing_database(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(app, 'DATABASE_URL', 'postgresql://test@localhost/test')
+    monkeypatch.setattr(app, 'db_pool', pool)
+    monkeypatch.setattr(app, 'db_breaker', make_breaker(open_seconds=30))
+    monkeypatch.setattr(app, 'background_tasks', {})
+    monkeypatch.setattr(app, 'RATE_LIMIT_ENABLED', False)
+    monkeypatch.setattr(app.schema_migrator, 'ensure_current', lambda: None)
+    monkeypatch.setattr(app.visit_recorder, 'record', lambda endpoint: None)
+    return pool
+
+
+def test_failing_statements_open_the_circuit(failing_database):
+    client = app.app.test_client()
+    for _ in range(4):
+        response = client.get('/api/users/search?q=ann')
+        assert response.status_code == 503
+        assert 'Retry-After' in response.headers
+    assert failing_database.broken == 4  # dead connections are not reused
+    assert app.db_breaker.state == 'open'
+
+    # Open: answered at once, without asking the pool
+    failing_database.checkout = None
+    response = client.get('/api/users/search?q=ann')
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) > 1
+    response = client.post('/api/users', json={'name': 'Ann', 'email': 'ann@example.com'})
+    assert response.status_code == 503
@@ -0,0 +1,173 @@
+"""
+Tests for ConnectionPool (see CONNECTION POOL SETTINGS in app.py)
+
+FakeConnection stands in for a psycopg2 connection, so no database is
+needed. The pool's clock (time.monotonic) is replaced where age matters.
+"""
+
+import app
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.closed = False
+        self.rollbacks = 0
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def get_transaction_status(self):
+        if self.in_transaction:
+            return app.psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        return app.TRANSACTION_STATUS_IDLE
+
+
+class Connector:
+    """The pool's connect() - counts the connections it opened"""
+
+    def __init__(self):
+        self.opened = []
+        self.fail = False
+
+    def __call__(self):
+        if self.fail:
+            return None
+        conn = FakeConnection(len(self.opened) + 1)
+        self.opened.append(conn)
+        return conn
+
+
+def make_pool(**settings):
+    options = dict(min_size=1, max_size=2, timeout=0.01, max_age=1800.0,
+                   check_idle=3600.0, name='test')
+    options.update(settings)
+    connect = Connector()
+    return app.ConnectionPool(connect, **options), connect
+
+
+def test_connections_are_reused():
+    pool, connect = make_pool()
+    conn = pool.checkout()
+    pool.checkin(conn)
+    assert pool.checkout() is conn
+    assert len(connect.opened) == 1
+
+
+def test_open_transactions_are_rolled_back_on_checkin():
+    pool, _ = make_pool()
+    conn = pool.checkout()
+    conn.in_transaction = True
+    pool.checkin(conn)
+    assert conn.rollbacks == 1
+    assert pool.checkout() is conn
+
+
+def test_checkout_gives_up_when_every_connection_is_busy():
+    pool, _ = make_pool(max_size=2)
+    first, second = pool.checkout(), pool.checkout()
+    assert first is not second
+    assert pool.checkout() is None
+    stats = pool.stats()
+    assert stats['in_use'] == 2 and stats['waits'] == 1 and stats['timeouts'] == 1
+
+
+def test_broken_connections_are_replaced():
+    pool, connect = make_pool()
+    conn = pool.checkout()
+    pool.checkin(conn, broken=True)
+    assert conn.closed
+    assert pool.stats()['size'] == 0
+    assert pool.checkout() is not conn
+    assert pool.stats()['discarded'] == 1
+
+
+def test_old_connections_are_closed_instead_of_reused(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(app.time, 'monotonic', lambda: now[0])
+    pool, connect = make_pool(max_age=60)
+    conn = pool.checkout()
+    pool.checkin(conn)
+    now[0] += 61
+    fresh = pool.checkout()
+    assert fresh is not conn and conn.closed
+    assert len(connect.opened) == 2
+
+
+def test_unreachable_database_gives_none_and_frees_the_slot():
+    pool, connect = make_pool(min_size=0, max_size=1)
+    connect.fail = True
+    assert pool.checkout() is None
+    assert pool.stats()['size'] == 0
+    connect.fail = False
+    assert pool.checkout() is not None
+
+
+def test_pool_starts_over_after_a_fork(monkeypatch):
+    pool, connect = make_pool()
+    inherited = pool.checkout()
+    pool.checkin(inherited)
+
+    child_pid = pool.pid + 1
+    monkeypatch.setattr(app.os, 'getpid', lambda: child_pid)  # "we are the child now"
+    conn = pool.checkout()
+    assert conn is not inherited
+    assert not inherited.closed  # the parent's socket is left alone
+    assert pool.stats()['size'] == 1 and pool.pid == child_pid
+
+
+# ----------------------------------------------------------------------------
+# get_db_connection(): borrow for a "with" block, always give it back
+# ----------------------------------------------------------------------------
+
+def use_pool(monkeypatch, pool):
+    monkeypatch.setattr(app, 'DATABASE_URL', 'postgresql://test@localhost/test')
+    monkeypatch.setattr(app, 'db_pool', pool)
+    monkeypatch.setattr(app, 'db_breaker', app.CircuitBreaker(enabled=False))
+    monkeypatch.setattr(app.schema_migrator, 'ensure_current', lambda: None)
+
+
+def test_connection_goes_back_after_the_block(monkeypatch):
+    pool, _ = make_pool()
+    use_pool(monkeypatch, pool)
+    with app.get_db_connection() as conn:
+        assert conn is not None
+        assert pool.stats()['in_use'] == 1
+    assert pool.stats()['in_use'] == 0
+    with app.get_db_connection() as again:
+        assert again is conn
+
+
+def test_connection_goes_back_even_if_the_code_crashed(monkeypatch):
+    pool, _ = make_pool()
+    use_pool(monkeypatch, pool)
+    try:
+        with app.get_db_connection():
+            raise ValueError('bug in the route')
+    except ValueError:
+        pass
+    stats = pool.stats()
+    assert stats['in_use'] == 0 and stats['idle'] == 1
+
+
+def test_dead_connections_are_not_reused(monkeypatch):
+    pool, _ = make_pool()
+    use_pool(monkeypatch, pool)
+    try:
+        with app.get_db_connection() as conn:
+            raise app.psycopg2.OperationalError('server closed the connection')
+    except app.psycopg2.OperationalError:
+        pass
+    assert conn.closed
+    assert pool.stats()['size'] == 0
+
+
+def test_no_database_configured(monkeypatch):
+    monkeypatch.setattr(app, 'DATABASE_URL', None)
+    with app.get_db_connection() as conn:
+        assert conn is None
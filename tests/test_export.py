@@ -0,0 +1,67 @@
+"""
+Tests for GET /api/users/export (see EXPORT: STREAM THE WHOLE USERS TABLE in app.py)
+"""
+
+import datetime
+import gzip
+import json
+
+import app
+
+ROWS = [
+    {'id': 1, 'name': 'Ann', 'email': 'ann@example.com', 'created_at': datetime.datetime(2024, 5, 1, 12, 0)},
+    {'id': 2, 'name': 'Bob, Jr.', 'email': 'bob@example.com', 'created_at': None},
+]
+
+
+def test_ndjson_one_user_per_line(fake_db, client, monkeypatch):
+    monkeypatch.setattr(app, 'EXPORT_BATCH_SIZE', 1)
+    fake_db.on('FROM users', ROWS)
+    response = client.get('/api/users/export')
+    assert response.status_code == 200
+    assert response.content_type == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line['id'] for line in lines] == [1, 2]
+    assert lines[0]['created_at'] == '2024-05-01T12:00:00'
+    assert fake_db.checked_out == 0  # the connection is back in the pool
+
+
+def test_csv_with_header_and_quoting(fake_db, client):
+    fake_db.on('FROM users', [{'id': 2, 'name': 'Bob, Jr.'}])
+    response = client.get('/api/users/export?format=csv&fields=name')
+    assert response.headers['Content-Disposition'] == 'attachment; filename=users.csv'
+    assert response.get_data(as_text=True).splitlines() == ['id,name', '2,"Bob, Jr."']
+    [(query, _)] = fake_db.statements('FROM users')
+    assert query == 'SELECT "id", "name" FROM users ORDER BY id'
+
+
+def test_gzip_stream(fake_db, client):
+    fake_db.on('FROM users', ROWS)
+    response = client.get('/api/users/export', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(gzip.decompress(response.get_data()).splitlines()) == 2
+
+
+def test_rows_are_read_in_batches(fake_db, client, monkeypatch):
+    batches = []
+
+    def record_batch(fields, rows):
+        batches.append(rows)
+        return ''
+
+    monkeypatch.setattr(app, 'EXPORT_BATCH_SIZE', 1)
+    monkeypatch.setitem(app.EXPORT_FORMATS, 'ndjson', ('application/x-ndjson', 'ndjson', record_batch))
+    fake_db.on('FROM users', ROWS)
+    client.get('/api/users/export').get_data()
+    assert [len(batch) for batch in batches] == [1, 1]
+
+
+def test_unknown_format(fake_db, client):
+    response = client.get('/api/users/export?format=xml')
+    assert response.status_code == 400
+    assert fake_db.checked_out == 0
+
+
+def test_database_not_available(fake_db, client):
+    fake_db.available = False
+    assert client.get('/api/users/export').status_code == 503
@@ -0,0 +1,82 @@
+"""
+Tests for the health checks (see HealthMonitor and /health/* in app.py)
+"""
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def monitor(fake_db, monkeypatch):
+    monitor = app.HealthMonitor()
+    monkeypatch.setattr(app, 'health_monitor', monitor)
+    monkeypatch.setattr(app.schema_migrator, 'is_current', lambda: True)
+    return monitor
+
+
+@pytest.fixture
+def open_circuit(fake_db, monkeypatch):
+    breaker = app.CircuitBreaker(open_seconds=60)
+    breaker._open('test')
+    monkeypatch.setattr(app, 'db_breaker', breaker)
+    return breaker
+
+
+def test_successful_check(monitor, fake_db):
+    monitor.check()
+    state = monitor.state()
+    assert state['healthy'] is True and state['last_error'] is None
+    assert state['total_checks'] == 1
+    assert fake_db.statements('SELECT 1')
+    assert monitor.is_ready()
+
+
+def test_failures_in_a_row_make_it_not_ready(monitor, fake_db):
+    monitor.check()
+    fake_db.on('SELECT 1', app.psycopg2.OperationalError('server closed the connection'))
+    for _ in range(app.HEALTH_FAILURE_THRESHOLD - 1):
+        monitor.check()
+    assert monitor.is_ready()  # not yet
+    monitor.check()
+    state = monitor.state()
+    assert state['consecutive_failures'] == app.HEALTH_FAILURE_THRESHOLD
+    assert 'server closed the connection' in state['last_error']
+    assert not monitor.is_ready()
+
+
+def test_never_reached_the_database(monitor, fake_db):
+    fake_db.available = False
+    assert monitor.state()['last_error'] == 'Database not available'  # checks once on first use
+    assert not monitor.is_ready()
+
+
+def test_the_check_goes_around_an_open_circuit(monitor, fake_db, open_circuit):
+    monitor.check()
+    assert monitor.state()['healthy'] is True
+    assert open_circuit.state == 'open'
+    assert open_circuit.rejected == 0
+
+
+def test_ready_while_the_circuit_is_open(monitor, client, open_circuit):
+    response = client.get('/health/ready')
+    assert response.status_code == 200
+    assert response.get_json()['database_circuit']['state'] == 'open'
+    health = client.get('/health').get_json()
+    assert health['status'] == 'degraded' and health['database'] == 'connected'
+
+
+def test_not_ready_with_an_old_schema(monitor, client, monkeypatch):
+    monkeypatch.setattr(app.schema_migrator, 'is_current', lambda: False)
+    assert client.get('/health/ready').status_code == 503
+
+
+def test_live_never_touches_the_database(monitor, client, fake_db):
+    assert client.get('/health/live').get_json()['status'] == 'alive'
+    assert fake_db.queries == []
+
+
+def test_without_a_database(client, monkeypatch):
+    monkeypatch.setattr(app, 'DATABASE_URL', None)
+    data = client.get('/health/ready').get_json()
+    assert data['status'] == 'ready' and data['database'] == 'not_configured'
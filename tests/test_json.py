@@ -0,0 +1,69 @@
+"""
+Tests for the JSON providers (see JSON SERIALIZATION in app.py)
+"""
+
+import datetime
+import decimal
+import json
+
+import pytest
+
+import app
+
+VALUE = {
+    'created_at': datetime.datetime(2025, 1, 31, 10, 0, 0, 123456),
+    'day': datetime.date(2025, 1, 31),
+    'price': decimal.Decimal('19.99'),
+}
+EXPECTED = {'created_at': '2025-01-31T10:00:00.123456', 'day': '2025-01-31', 'price': '19.99'}
+
+PROVIDERS = [app.AppJSONProvider]
+if app.orjson is not None:
+    PROVIDERS.append(app.OrjsonProvider)
+
+
+@pytest.fixture(params=PROVIDERS, ids=lambda provider: provider.__name__)
+def provider(request):
+    return request.param(app.app)
+
+
+def test_same_output_from_every_provider(provider):
+    assert json.loads(provider.dumps(VALUE)) == EXPECTED
+
+
+def test_response_body(provider):
+    with app.app.app_context():
+        response = provider.response({'at': VALUE['created_at']})
+    assert response.mimetype == 'application/json'
+    assert json.loads(response.get_data()) == {'at': EXPECTED['created_at']}
+
+
+def test_callers_default_is_used(provider):
+    class Point:
+        pass
+
+    assert json.loads(provider.dumps({'p': Point()}, default=lambda value: 'point')) == {'p': 'point'}
+
+
+def test_json_module_options_are_honoured(provider):
+    assert provider.dumps({'a': 1}, indent=4) == '{\n    "a": 1\n}'
+    assert provider.loads('{"n": 1.5}', parse_float=decimal.Decimal) == {'n': decimal.Decimal('1.5')}
+    assert provider.loads('{"n": 1.5}') == {'n': 1.5}
+
+
+def test_unknown_types_still_fail(provider):
+    with pytest.raises(TypeError):
+        provider.dumps({'x': object()})
+
+
+def test_dumps_line_keeps_key_order():
+    line = app.dumps_line({'b': 1, 'a': VALUE['day']})
+    assert line.endswith('\n') and '\n' not in line[:-1]
+    assert list(json.loads(line)) == ['b', 'a']
+    assert json.loads(line)['a'] == '2025-01-31'
+
+
+def test_created_at_is_iso_8601(fake_db, client):
+    fake_db.on('FROM users', [{'id': 1, 'name': 'Ann', 'email': 'a@example.com',
+                               'created_at': VALUE['created_at']}])
+    assert client.get('/api/users/1').get_json()['user']['created_at'] == EXPECTED['created_at']
@@ -0,0 +1,55 @@
+"""
+Tests for the Prometheus metrics (see METRICS and ROUTE: METRICS in app.py)
+"""
+
+import os
+import subprocess
+import sys
+
+import app
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def sample(name, **labels):
+    return app.REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_requests_are_counted_by_route_pattern(fake_db, client):
+    fake_db.on('FROM users', [{'id': 7, 'name': 'Ann', 'email': 'a@example.com', 'created_at': None}])
+    labels = {'method': 'GET', 'route': '/api/users/<int:user_id>'}
+    before = sample('http_requests_total', status='200', **labels)
+    client.get('/api/users/7')
+    assert sample('http_requests_total', status='200', **labels) == before + 1
+    assert sample('http_request_duration_seconds_count', **labels) >= 1
+    assert sample('http_requests_in_progress', **labels) == 0
+
+
+def test_unknown_urls_share_one_label(client):
+    before = sample('http_requests_total', method='GET', route='unmatched', status='404')
+    client.get('/no/such/page/123')
+    assert sample('http_requests_total', method='GET', route='unmatched', status='404') == before + 1
+
+
+def test_metrics_endpoint(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    assert b'http_requests_total' in response.data
+
+
+def test_missing_multiprocess_directory_is_created(tmp_path):
+    # A fresh interpreter: prometheus_client reads the variable at import
+    directory = tmp_path / 'prometheus' / 'metrics'
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(directory))
+    env.pop('DATABASE_URL', None)
+    result = subprocess.run([sys.executable, '-c', (
+        "import app\n"
+        "app.app.test_client().get('/health/live')\n"
+        "response = app.app.test_client().get('/metrics')\n"
+        "assert response.status_code == 200, response.status_code\n"
+        "assert b'http_requests_total' in response.data\n"
+    )], cwd=ROOT, env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert directory.is_dir()
+    assert any(directory.iterdir())  # the worker wrote its metric files there
@@ -0,0 +1,112 @@
+"""
+Tests for the migration runner (see SCHEMA MIGRATIONS in app.py)
+
+The real migrations are replaced by small ones that only send a marker
+statement, so the order of everything sent can be checked.
+"""
+
+import pytest
+
+import app
+
+
+def migration(number):
+    def migrate(cursor):
+        cursor.execute(f"-- migration {number}")
+    return migrate
+
+
+@pytest.fixture
+def migrations(fake_db, monkeypatch):
+    monkeypatch.setattr(app, 'MIGRATIONS', [(number, f'step {number}', migration(number)) for number in (1, 2, 3)])
+    monkeypatch.setattr(app, 'LATEST_SCHEMA_VERSION', 3)
+    return fake_db
+
+
+def at_version(db, version):
+    db.on('to_regclass', [('schema_migrations',)] if version else [(None,)])
+    db.on('MAX(version)', [(version,)])
+
+
+def sent(db):
+    return [query for query, _ in db.queries]
+
+
+def test_new_database_gets_every_migration_in_order(migrations):
+    at_version(migrations, 0)
+    assert app.run_migrations(migrations.connection) == [1, 2, 3]
+    queries = sent(migrations)
+    steps = [queries.index(f'-- migration {number}') for number in (1, 2, 3)]
+    assert steps == sorted(steps)
+    # Everything happens while the advisory lock is held
+    assert queries.index('SELECT pg_advisory_lock(%s)') < steps[0]
+    assert queries.index('SELECT pg_advisory_unlock(%s)') > steps[-1]
+    assert [params[0] for _, params in migrations.statements('INSERT INTO schema_migrations')] == [1, 2, 3]
+
+
+def test_only_newer_migrations_run(migrations):
+    at_version(migrations, 2)
+    assert app.run_migrations(migrations.connection) == [3]
+    assert '-- migration 2' not in sent(migrations)
+
+
+def test_failed_migration_keeps_the_last_good_version(migrations, monkeypatch):
+    def broken(cursor):
+        raise app.psycopg2.ProgrammingError('syntax error')
+
+    monkeypatch.setattr(app, 'MIGRATIONS', app.MIGRATIONS[:1] + [(2, 'broken', broken)] + app.MIGRATIONS[2:])
+    at_version(migrations, 0)
+    with pytest.raises(app.psycopg2.ProgrammingError):
+        app.run_migrations(migrations.connection)
+    assert [params[0] for _, params in migrations.statements('INSERT INTO schema_migrations')] == [1]
+    assert '-- migration 3' not in sent(migrations)
+    assert sent(migrations)[-1] == 'SELECT pg_advisory_unlock(%s)'  # the lock is released
+
+
+def test_current_schema_version(migrations):
+    cursor = migrations.connection.cursor()
+    at_version(migrations, 0)
+    assert app.current_schema_version(cursor) == 0
+    at_version(migrations, 7)
+    assert app.current_schema_version(cursor) == 7
+
+
+def test_migrator_checks_once_per_process(migrations):
+    at_version(migrations, 3)
+    migrator = app.SchemaMigrator()
+    migrator.ensure_current()
+    assert migrator.is_current() and migrator.stats()['version'] == 3
+    count = len(migrations.queries)
+    migrator.ensure_current()
+    assert len(migrations.queries) == count
+    assert migrations.checked_out == 0
+
+
+def test_migrator_applies_missing_migrations(migrations):
+    at_version(migrations, 1)
+    migrator = app.SchemaMigrator()
+    migrations.on('MAX(version)', lambda params: [(3,)] if migrator.applied else [(1,)])
+    migrator.ensure_current()
+    assert migrator.applied == [2, 3]
+    assert migrator.is_current()
+
+
+def test_old_schema_without_migrate_on_startup(migrations, monkeypatch):
+    monkeypatch.setattr(app, 'MIGRATE_ON_STARTUP', False)
+    at_version(migrations, 1)
+    migrator = app.SchemaMigrator()
+    migrator.ensure_current()
+    assert not migrator.is_current()
+    assert 'version 1' in migrator.stats()['last_error']
+    assert '-- migration 2' not in sent(migrations)
+    count = len(migrations.queries)
+    migrator.ensure_current()  # waits MIGRATION_RETRY_INTERVAL before checking again
+    assert len(migrations.queries) == count
+
+
+def test_unreachable_database(migrations):
+    migrations.available = False
+    migrator = app.SchemaMigrator()
+    migrator.ensure_current()
+    assert migrator.stats()['last_error'] == 'Database not available'
+    assert not migrator.is_current()
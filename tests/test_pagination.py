@@ -0,0 +1,64 @@
+"""
+Tests for GET /api/users: keyset pagination and ?fields= (see PAGINATION SETTINGS in app.py)
+"""
+
+import pytest
+
+import app
+
+
+def users(first, last, fields=('id', 'name', 'email')):
+    rows = [{'id': i, 'name': f'User {i}', 'email': f'user{i}@example.com'} for i in range(first, last + 1)]
+    return [{field: row[field] for field in fields} for row in rows]
+
+
+def test_first_page_and_cursor(fake_db, client):
+    fake_db.on('FROM users', users(1, 3))  # limit + 1 rows = there is another page
+    response = client.get('/api/users?limit=2')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [user['id'] for user in data['users']] == [1, 2]
+    assert data['next_cursor'] == 2
+    [(query, params)] = fake_db.statements('FROM users')
+    assert 'id > %s ORDER BY id LIMIT %s' in query
+    assert params == (0, 3)
+
+
+def test_next_page_starts_after_the_cursor(fake_db, client):
+    fake_db.on('FROM users', users(3, 4))
+    data = client.get('/api/users?limit=2&after_id=2').get_json()
+    assert data['count'] == 2
+    assert data['next_cursor'] is None  # no extra row = last page
+    assert fake_db.statements('FROM users')[0][1] == (2, 3)
+
+
+def test_only_the_requested_columns_are_selected(fake_db, client):
+    fake_db.on('FROM users', users(1, 1, fields=('id', 'email')))
+    data = client.get('/api/users?fields=email,id,email').get_json()
+    assert data['users'] == [{'id': 1, 'email': 'user1@example.com'}]
+    [(query, _)] = fake_db.statements('FROM users')
+    assert query.startswith('SELECT "id", "email" FROM users')
+
+
+@pytest.mark.parametrize('query', [
+    'limit=0', 'limit=abc', f'limit={app.USERS_MAX_PAGE_SIZE + 1}', 'after_id=-1',
+    'fields=password', 'fields=name;DROP TABLE users'
+])
+def test_bad_parameters_are_rejected_before_the_database(fake_db, client, query):
+    response = client.get(f'/api/users?{query}')
+    assert response.status_code == 400
+    assert fake_db.queries == []
+
+
+def test_parse_fields_arg():
+    assert app.parse_fields_arg({}) == list(app.USER_FIELDS)
+    assert app.parse_fields_arg({'fields': 'name, ,email'}) == ['id', 'name', 'email']
+    with pytest.raises(ValueError, match='Unknown field'):
+        app.parse_fields_arg({'fields': 'id,secret'})
+
+
+def test_database_not_available(fake_db, client):
+    fake_db.available = False
+    response = client.get('/api/users')
+    assert response.status_code == 503
+    assert response.get_json()['users'] == []
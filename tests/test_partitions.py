@@ -0,0 +1,101 @@
+"""
+Tests for the visits partitions and retention (see VISITS PARTITIONING in app.py)
+"""
+
+import datetime
+
+import pytest
+
+import app
+
+NOW = datetime.datetime(2025, 1, 30, 15, 45)
+
+
+class FixedDatetime(datetime.datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return NOW
+
+
+@pytest.fixture
+def frozen_time(monkeypatch):
+    monkeypatch.setattr(app.datetime, 'datetime', FixedDatetime)
+
+
+@pytest.fixture
+def monthly(monkeypatch):
+    monkeypatch.setattr(app, 'VISITS_PARTITION_INTERVAL', 'month')
+    monkeypatch.setattr(app, 'PARTITION_NAME_FORMAT', 'visits_p%Y%m')
+
+
+def created(db):
+    return [query.split()[5] for query, _ in db.statements('PARTITION OF visits')]
+
+
+def test_daily_partition_bounds():
+    assert app.partition_start(NOW) == datetime.datetime(2025, 1, 30)
+    assert app.next_partition_start(datetime.datetime(2024, 12, 31)) == datetime.datetime(2025, 1, 1)
+
+
+def test_monthly_partition_bounds(monthly):
+    assert app.partition_start(NOW) == datetime.datetime(2025, 1, 1)
+    assert app.next_partition_start(datetime.datetime(2024, 12, 1)) == datetime.datetime(2025, 1, 1)
+    assert app.next_partition_start(datetime.datetime(2025, 1, 1)) == datetime.datetime(2025, 2, 1)
+
+
+def test_ensure_creates_yesterday_to_days_ahead(fake_db, frozen_time, monkeypatch):
+    monkeypatch.setattr(app, 'VISITS_PARTITIONS_AHEAD', 2)
+    app.ensure_visit_partitions(fake_db.connection.cursor(), [datetime.datetime(2024, 6, 1, 8)])
+    assert fake_db.queries[0] == ('SELECT pg_advisory_xact_lock(%s)', (app.SCHEMA_LOCK_ID,))
+    assert created(fake_db) == ['"visits_p20240601"', '"visits_p20250129"', '"visits_p20250130"',
+                                '"visits_p20250131"', '"visits_p20250201"']
+    _, bounds = fake_db.statements('"visits_p20250131"')[0]
+    assert bounds == (datetime.datetime(2025, 1, 31), datetime.datetime(2025, 2, 1))
+
+
+def test_ensure_monthly(fake_db, frozen_time, monthly, monkeypatch):
+    monkeypatch.setattr(app, 'VISITS_PARTITIONS_AHEAD', 1)
+    app.ensure_visit_partitions(fake_db.connection.cursor())
+    assert created(fake_db) == ['"visits_p202412"', '"visits_p202501"', '"visits_p202502"']
+
+
+def test_list_ignores_foreign_partitions(fake_db):
+    fake_db.on('FROM pg_inherits', [('visits_p20250130',), ('visits_archive',), ('visits_p20250129',)])
+    assert app.list_visit_partitions(fake_db.connection.cursor()) == [
+        (datetime.datetime(2025, 1, 29), 'visits_p20250129'),
+        (datetime.datetime(2025, 1, 30), 'visits_p20250130'),
+    ]
+
+
+def test_drop_expired_partitions(fake_db, frozen_time, monkeypatch):
+    monkeypatch.setattr(app, 'VISITS_RETENTION_DAYS', 2)
+    fake_db.on('FROM pg_inherits', [('visits_p20250127',), ('visits_p20250128',), ('visits_p20250129',)])
+    # Cutoff 2025-01-28 15:45: only the 27th has ended before it
+    assert app.drop_expired_visit_partitions(fake_db.connection.cursor()) == ['visits_p20250127']
+    assert [query for query, _ in fake_db.statements('visits_p')] == [
+        "UPDATE table_counters SET value = value - (SELECT COUNT(*) FROM \"visits_p20250127\") "
+        "WHERE name = 'visits'",
+        'DROP TABLE "visits_p20250127"',
+    ]
+
+
+def test_retention_off_keeps_everything(fake_db):
+    assert app.VISITS_RETENTION_DAYS == 0
+    assert app.drop_expired_visit_partitions(fake_db.connection.cursor()) == []
+    assert fake_db.queries == []
+
+
+def test_maintenance_job_commits(fake_db, frozen_time, monkeypatch):
+    monkeypatch.setattr(app, 'VISITS_RETENTION_DAYS', 1)
+    fake_db.on('FROM pg_inherits', [('visits_p20250101',)])
+    app.maintain_visit_partitions()
+    assert fake_db.statements('DROP TABLE')
+    assert fake_db.connection.commits == 1
+    assert fake_db.checked_out == 0
+
+
+def test_maintenance_job_rolls_back_on_errors(fake_db):
+    fake_db.on('pg_advisory_xact_lock', RuntimeError('lock timeout'))
+    with pytest.raises(RuntimeError):
+        app.maintain_visit_partitions()
+    assert fake_db.connection.rollbacks == 1
@@ -0,0 +1,152 @@
+"""
+Tests for query fingerprints, QueryStats and the profiled cursors
+(see QUERY PROFILING and PREPARED STATEMENTS in app.py)
+"""
+
+import pytest
+
+import app
+
+
+def test_literals_are_replaced():
+    assert app.query_fingerprint(
+        "SELECT * FROM users WHERE id = 42 AND email = 'it''s@example.com'"
+    ) == "SELECT * FROM users WHERE id = ? AND email = ?"
+
+
+def test_whitespace_is_collapsed():
+    assert app.query_fingerprint(
+        "SELECT id\n    FROM   users\n    WHERE id > 10.5"
+    ) == "SELECT id FROM users WHERE id > ?"
+
+
+def test_numbers_inside_names_are_kept():
+    assert app.query_fingerprint("SELECT col1 FROM visits_2024_05") == "SELECT col1 FROM visits_2024_05"
+
+
+def test_multi_row_inserts_share_one_fingerprint():
+    two = app.query_fingerprint("INSERT INTO users (name, email) VALUES ('a', 'b'), ('c', 'd')")
+    three = app.query_fingerprint("INSERT INTO users (name, email) VALUES ('a', 'b'), ('c', 'd'), ('e', 'f')")
+    assert two == three == "INSERT INTO users (name, email) VALUES (?, ?), ..."
+
+
+def test_long_statements_are_fingerprinted_too():
+    text = "INSERT INTO visits (endpoint) VALUES " + ", ".join(["('/api')"] * 500)
+    assert app.query_fingerprint(text) == "INSERT INTO visits (endpoint) VALUES (?), ..."
+
+
+def test_totals_per_fingerprint():
+    stats = app.QueryStats(max_queries=10)
+    stats.record('SELECT ?', '/a', 0.002, 1, False)
+    stats.record('SELECT ?', '/b', 0.004, -1, True)
+    [row] = stats.stats()
+    assert row['calls'] == 2
+    assert row['errors'] == 1
+    assert row['rows'] == 1  # -1 = "no row count", not subtracted
+    assert row['total_ms'] == 6.0 and row['mean_ms'] == 3.0 and row['max_ms'] == 4.0
+    assert row['routes'] == ['/a', '/b']
+
+
+def test_new_statements_beyond_the_limit_go_to_other():
+    stats = app.QueryStats(max_queries=2)
+    for query in ('SELECT 1', 'SELECT 2', 'SELECT 3', 'SELECT 4'):
+        stats.record(query, '/a', 0.001, 0, False)
+    stats.record('SELECT 1', '/a', 0.001, 0, False)  # known ones are still counted
+    calls = {row['query']: row['calls'] for row in stats.stats()}
+    assert calls == {'SELECT 1': 2, 'SELECT 2': 1, '<other>': 2}
+
+
+def test_sorting_and_limit():
+    stats = app.QueryStats(max_queries=10)
+    stats.record('slow', '/a', 0.5, 0, False)
+    for _ in range(3):
+        stats.record('frequent', '/a', 0.01, 0, False)
+    assert [row['query'] for row in stats.stats()] == ['slow', 'frequent']
+    assert [row['query'] for row in stats.stats(sort='calls', limit=1)] == ['frequent']
+
+
+class RecordingCursor:
+    """Stands in for a psycopg2 cursor: remembers what it was asked to run"""
+
+    rowcount = 3
+
+    def __init__(self, error=None):
+        self.error = error
+        self.sent = []
+        self.connection = None
+
+    def execute(self, query, params=None):
+        self.sent.append((query, params))
+        if self.error is not None:
+            raise self.error
+
+
+class TimedCursor(app.TimedCursorMixin, RecordingCursor):
+    pass
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    stats = app.QueryStats(max_queries=10)
+    monkeypatch.setattr(app, 'query_stats', stats)
+    return stats
+
+
+def test_statements_are_tagged_and_recorded(stats):
+    with app.app.test_request_context('/api/users'):
+        app.g.request_id = 'abc'
+        cursor = TimedCursor()
+        cursor.execute("SELECT * FROM users WHERE id = %s", (7,))
+    [(query, params)] = cursor.sent
+    assert query == "/* route='/api/users',request_id='abc' */ SELECT * FROM users WHERE id = %s"
+    assert params == (7,)
+    [row] = stats.stats()
+    assert row['query'] == 'SELECT * FROM users WHERE id = %s'
+    assert row['routes'] == ['/api/users'] and row['rows'] == 3
+
+
+def test_failed_statements_are_logged(stats, capsys):
+    cursor = TimedCursor(error=app.psycopg2.ProgrammingError('no such column'))
+    with pytest.raises(app.psycopg2.ProgrammingError):
+        cursor.execute("SELECT nope FROM users")
+    assert stats.stats()[0]['errors'] == 1
+    assert 'no such column' in capsys.readouterr().out
+
+
+def test_constraint_violations_are_only_counted(stats, capsys):
+    app.record_query("INSERT INTO users ...", '/api/users', None, 0.001, 0, app.psycopg2.IntegrityError('dup'))
+    assert stats.stats()[0]['errors'] == 1
+    assert capsys.readouterr().out == ''
+
+
+def test_slow_statements_are_logged(stats, capsys, monkeypatch):
+    monkeypatch.setattr(app, 'SLOW_QUERY_MS', 100)
+    app.record_query("SELECT pg_sleep(1)", 'background', None, 0.5, 1, None)
+    assert 'Slow query 500.0 ms [route=background request_id=-]' in capsys.readouterr().out
+
+
+def test_prepared_once_per_connection(monkeypatch):
+    monkeypatch.setattr(app, 'DB_PREPARED_STATEMENTS', True)
+    cursor = RecordingCursor()
+    cursor.connection = type('Connection', (), {'prepared': set()})()
+    app.execute_prepared(cursor, 'list_users', (0, 10))
+    app.execute_prepared(cursor, 'list_users', (10, 10))
+    assert [query for query, _ in cursor.sent] == [
+        f"PREPARE list_users AS {app.PREPARED_QUERIES['list_users']}",
+        "EXECUTE list_users (%s, %s)",
+        "EXECUTE list_users (%s, %s)",
+    ]
+
+
+def test_without_prepared_statements(monkeypatch):
+    monkeypatch.setattr(app, 'DB_PREPARED_STATEMENTS', False)
+    cursor = RecordingCursor()
+    app.execute_prepared(cursor, 'list_users', (0, 10))
+    assert cursor.sent == [(app.PREPARED_QUERIES['list_users'].replace('$1', '%s').replace('$2', '%s'), (0, 10))]
+
+
+def test_queries_endpoint(fake_db, client, stats):
+    stats.record('SELECT ?', '/a', 0.002, 1, False)
+    data = client.get('/api/queries?sort=calls&limit=5').get_json()
+    assert data['sort'] == 'calls' and data['queries'][0]['query'] == 'SELECT ?'
+    assert client.get('/api/queries?sort=nope').status_code == 400
@@ -0,0 +1,124 @@
+"""
+Tests for rate limiting (see RATE LIMITING AND LOAD SHEDDING in app.py)
+
+The token buckets use time.monotonic(), which is replaced by a fake clock
+here, so nothing actually sleeps.
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import app
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(app.time, 'monotonic', fake)
+    return fake
+
+
+def test_parse_route_limits():
+    limits = app.parse_route_limits('GET /api/users=20:40, post /api/users/bulk=2 ,')
+    assert limits == {
+        ('GET', '/api/users'): (20.0, 40.0),
+        ('POST', '/api/users/bulk'): (2.0, 2.0)  # no burst = same as the rate
+    }
+    assert app.parse_route_limits('') == {}
+
+
+@pytest.mark.parametrize('text', ['GET /api/users=0', '/api/users=5', 'GET /api/users=5:0.5'])
+def test_parse_route_limits_rejects_bad_entries(text):
+    with pytest.raises(ValueError):
+        app.parse_route_limits(text)
+
+
+def test_bucket_allows_the_burst_then_asks_to_wait(clock):
+    backend = app.MemoryRateLimitBackend()
+    for _ in range(3):
+        assert backend.take('client', rate=2, burst=3) == 0
+    assert backend.take('client', rate=2, burst=3) == pytest.approx(0.5)
+
+
+def test_bucket_refills_with_time_up_to_the_burst(clock):
+    backend = app.MemoryRateLimitBackend()
+    for _ in range(3):
+        backend.take('client', rate=2, burst=3)
+    clock.now += 0.5  # one new token
+    assert backend.take('client', rate=2, burst=3) == 0
+    assert backend.take('client', rate=2, burst=3) > 0
+
+    clock.now += 60  # a long pause only refills up to the burst
+    for _ in range(3):
+        assert backend.take('client', rate=2, burst=3) == 0
+    assert backend.take('client', rate=2, burst=3) > 0
+
+
+def test_clients_have_their_own_buckets(clock):
+    backend = app.MemoryRateLimitBackend()
+    assert backend.take('a', rate=1, burst=1) == 0
+    assert backend.take('a', rate=1, burst=1) > 0
+    assert backend.take('b', rate=1, burst=1) == 0
+
+
+def test_least_recently_used_clients_are_forgotten(clock):
+    backend = app.MemoryRateLimitBackend(max_keys=2)
+    for key in ('a', 'b', 'a', 'c'):
+        backend.take(key, rate=1, burst=5)
+    assert list(backend.buckets) == ['a', 'c']
+
+
+def test_limiter_checks_the_client_and_the_route(clock):
+    limiter = app.RateLimiter(10, 10, {('POST', '/api/users'): (1.0, 1.0)})
+    assert limiter.check('1.2.3.4', 'POST', '/api/users') is None
+    limit, wait = limiter.check('1.2.3.4', 'POST', '/api/users')
+    assert limit == 'route' and wait == pytest.approx(1.0)
+    assert limiter.check('1.2.3.4', 'GET', '/api/users') is None  # other routes still work
+    assert limiter.stats()['rejected'] == {'client': 0, 'route': 1}
+
+
+def test_shedder_refuses_work_over_the_in_flight_limit(fake_db):
+    shedder = app.LoadShedder(max_in_flight=2, pool_waiters=0, pool_wait=0)
+    assert shedder.enter() is None and shedder.enter() is None
+    assert shedder.enter() == 'in_flight'
+    shedder.leave()
+    assert shedder.enter() is None
+    assert shedder.stats()['shed'] == {'in_flight': 1, 'pool': 0}
+
+
+def test_rate_limited_request_gets_429(fake_db, client, monkeypatch, clock):
+    monkeypatch.setattr(app, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setattr(app, 'rate_limiter', app.RateLimiter(1, 1, {}))
+    assert client.get('/api/info').status_code == 200
+    response = client.get('/api/info')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+
+
+@pytest.mark.parametrize('env, rate_limited, max_in_flight', [
+    ({}, False, 7),
+    ({'GUNICORN_THREADS': '4'}, False, 3),
+    ({'SERVER_MODE': 'async'}, False, 64),
+    ({'RATE_LIMIT_ENABLED': 'true', 'SHED_MAX_IN_FLIGHT': '0'}, True, 0),
+])
+def test_defaults(env, rate_limited, max_in_flight):
+    # A fresh interpreter: the settings are read at import
+    clean = {name: value for name, value in os.environ.items()
+             if name not in ('DATABASE_URL', 'GUNICORN_THREADS', 'SERVER_MODE',
+                             'RATE_LIMIT_ENABLED', 'SHED_MAX_IN_FLIGHT')}
+    result = subprocess.run([sys.executable, '-c', 'import app; print(app.RATE_LIMIT_ENABLED, app.SHED_MAX_IN_FLIGHT)'],
+                            cwd=ROOT, env=dict(clean, **env), capture_output=True, text=True, timeout=60)
+    assert result.stdout.split()[-2:] == [str(rate_limited), str(max_in_flight)], result.stderr
@@ -0,0 +1,97 @@
+"""
+Tests for read replica routing (see READ REPLICAS in app.py)
+
+Each replica's connection pool is a FakeDatabase of its own, so the tests
+can see which database a statement went to.
+"""
+
+import pytest
+
+import app
+from conftest import FakeDatabase
+
+ANN = {'id': 1, 'name': 'Ann', 'email': 'ann@example.com', 'created_at': None}
+
+
+def make_replica(name, lag=0.0, latency=0.01, healthy=True):
+    replica = app.Replica(f'postgresql://test@{name}:5432/test')
+    replica.pool = FakeDatabase()
+    replica.healthy, replica.lag, replica.latency = healthy, lag, latency
+    return replica
+
+
+@pytest.fixture
+def replicas(fake_db, monkeypatch):
+    replica_set = app.ReplicaSet([], 'round_robin')
+    replica_set.replicas = [make_replica('replica-1'), make_replica('replica-2')]
+    monkeypatch.setattr(app, 'replica_set', replica_set)
+    return replica_set
+
+
+def test_round_robin_skips_unusable_replicas(replicas):
+    first, second = replicas.replicas
+    assert [replicas.choose() for _ in range(4)] == [first, second, first, second]
+    second.lag = app.REPLICA_MAX_LAG + 1  # too far behind
+    assert [replicas.choose() for _ in range(2)] == [first, first]
+    first.healthy = False
+    assert replicas.choose() is None
+
+
+def test_least_latency(replicas):
+    replicas.selection = 'least_latency'
+    replicas.replicas[0].latency = 0.05
+    assert replicas.choose() is replicas.replicas[1]
+
+
+def test_check_measures_lag(replicas):
+    replica = replicas.replicas[0]
+    replica.healthy, replica.lag = False, None
+    replica.pool.on('pg_is_in_recovery', [(1.5,)])
+    replica.check()
+    assert replica.healthy and replica.lag == 1.5
+    replica.pool.on('pg_is_in_recovery', app.psycopg2.OperationalError('gone'))
+    replica.check()
+    assert not replica.usable()
+    assert replica.last_error == 'gone'
+    assert replica.pool.checked_out == 0
+
+
+def test_choose_read_pool_without_replicas(fake_db):
+    assert app.choose_read_pool() == (None, 'no_replicas')
+
+
+def test_reads_go_to_a_replica(replicas, fake_db):
+    with app.get_db_connection(read_only=True) as conn:
+        assert conn is replicas.replicas[0].pool.connection
+    with app.get_db_connection() as conn:
+        assert conn is fake_db.connection  # writes always go to the primary
+
+
+def test_unreachable_replica_falls_back_to_the_primary(replicas, fake_db):
+    replica = replicas.replicas[0]
+    replica.pool.available = False
+    with app.get_db_connection(read_only=True) as conn:
+        assert conn is fake_db.connection
+    assert not replica.healthy
+
+
+def test_a_write_pins_the_clients_reads_to_the_primary(replicas, fake_db, client):
+    fake_db.on('INSERT INTO users', [ANN])
+    response = client.post('/api/users', json={'name': 'Ann', 'email': 'ann@example.com'})
+    assert response.status_code == 201
+    assert app.READ_PRIMARY_COOKIE in response.headers['Set-Cookie']
+
+    # The test client sends the cookie back: the next read skips the
+    # response cache and the replicas
+    fake_db.on('FROM users', [ANN])
+    response = client.get('/api/users')
+    assert response.headers['X-Cache'] == 'BYPASS'
+    assert fake_db.statements('FROM users ')
+    assert not any(replica.pool.queries for replica in replicas.replicas)
+
+
+def test_an_expired_cookie_reads_from_replicas_again(replicas):
+    with app.app.test_request_context(headers={'Cookie': f'{app.READ_PRIMARY_COOKIE}=0'}):
+        assert app.choose_read_pool() == (replicas.replicas[0], 'replica')
+    with app.app.test_request_context(headers={'Cookie': f'{app.READ_PRIMARY_COOKIE}={app.time.time() + 5}'}):
+        assert app.choose_read_pool() == (None, 'read_your_writes')
@@ -0,0 +1,110 @@
+"""
+Tests for the response cache and its ETags (see RESPONSE CACHE (WITH ETAGS) in app.py)
+"""
+
+import pytest
+
+import app
+
+ANN = {'id': 1, 'name': 'Ann', 'email': 'ann@example.com', 'created_at': None}
+
+
+def entry(text):
+    body = text.encode()
+    return body, app.make_etag(body), 'application/json'
+
+
+def test_get_and_set():
+    cache = app.ResponseCache()
+    assert cache.get('a') is None
+    cache.set('a', entry('{}'))
+    assert cache.get('a') == entry('{}')
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_least_recently_used_entry_is_dropped():
+    cache = app.ResponseCache(max_entries=2)
+    cache.set('a', entry('a'))
+    cache.set('b', entry('b'))
+    cache.get('a')  # 'b' is now the oldest
+    cache.set('c', entry('c'))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+
+
+def test_entries_expire(monkeypatch):
+    cache = app.ResponseCache(ttl=5)
+    cache.set('a', entry('a'))
+    later = app.time.monotonic() + 6
+    monkeypatch.setattr(app.time, 'monotonic', lambda: later)
+    assert cache.get('a') is None
+
+
+def test_bump_changes_the_version():
+    cache = app.ResponseCache()
+    assert cache.version('users') == 0
+    cache.bump('users')
+    assert cache.version('users') == 1
+    assert cache.version('stats') == 0
+
+
+def test_shared_backend_is_seen_by_other_workers():
+    backend = app.MemoryCacheBackend()
+    worker_1 = app.ResponseCache(backend=backend)
+    worker_2 = app.ResponseCache(backend=backend)
+    worker_1.set('users:0:/api/users?', entry('{"users": []}'))
+    worker_1.bump('users')
+    assert worker_2.get('users:0:/api/users?') == entry('{"users": []}')
+    assert worker_2.version('users') == 1
+
+
+@pytest.fixture
+def users_db(fake_db):
+    fake_db.on('FROM users', [ANN])
+    return fake_db
+
+
+def test_miss_then_hit(users_db, client):
+    first = client.get('/api/users')
+    second = client.get('/api/users')
+    assert (first.headers['X-Cache'], second.headers['X-Cache']) == ('MISS', 'HIT')
+    assert first.data == second.data
+    assert len(users_db.statements('FROM users')) == 1
+
+
+def test_if_none_match_gets_304(users_db, client):
+    etag = client.get('/api/users').headers['ETag']
+    response = client.get('/api/users', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_a_write_makes_old_entries_unreachable(users_db, client):
+    client.get('/api/users')
+    app.response_cache.bump('users')
+    assert client.get('/api/users').headers['X-Cache'] == 'MISS'
+    assert len(users_db.statements('FROM users')) == 2
+
+
+def test_errors_are_not_cached(fake_db, client):
+    fake_db.available = False
+    assert client.get('/api/users').status_code == 503
+    fake_db.available = True
+    assert client.get('/api/users').status_code == 200
+
+
+def test_visit_flushes_keep_the_stats_etag(fake_db, client):
+    app.stats_cache.clear()
+    try:
+        fake_db.on('FROM table_counters', [{'name': 'users', 'value': 3}, {'name': 'visits', 'value': 40}])
+        etag = client.get('/api/stats').headers['ETag']
+        recorder = app.VisitRecorder(batch_size=100, flush_interval=3600, max_buffer=10)
+        recorder.record('/api/users')
+        recorder.flush()
+        recorder.stopping = True
+        recorder.wakeup.set()
+        assert app.stats_cache.get()[3] is False  # no reload that would change the ETag
+        response = client.get('/api/stats', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+    finally:
+        app.stats_cache.clear()
@@ -0,0 +1,113 @@
+"""
+Tests for the visit rollups (see ANALYTICS ROLLUPS in app.py)
+"""
+
+import datetime
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def rollup_db(fake_db):
+    fake_db.on('FOR UPDATE SKIP LOCKED', [(0, None, None)])
+    fake_db.on('pg_snapshot_xmin', [(True,)])
+    fake_db.on('pg_sequence_last_value', [(500,)])
+    fake_db.on('pg_snapshot_xmax', [('900',)])
+    fake_db.on('SELECT COUNT(*), MAX(id)', [(50, 500)])
+    fake_db.on('SELECT COUNT(*) FROM visits', [(50,)])
+    return fake_db
+
+
+def watermark_update(db):
+    [(_, params)] = db.statements('UPDATE rollup_watermarks')
+    return params[:3]  # last_id, pending_id, pending_xmax
+
+
+def test_first_run_only_leaves_a_marker(rollup_db):
+    assert app.run_visit_rollup() == 0
+    assert rollup_db.statements('INSERT INTO') == []
+    assert watermark_update(rollup_db) == (0, 500, '900')
+    # The id is read before the snapshot, in separate statements
+    statements = [query for query, _ in rollup_db.queries]
+    assert statements.index("SELECT COALESCE(pg_sequence_last_value('visits_id_seq'), 0)") < \
+        statements.index('SELECT pg_snapshot_xmax(pg_current_snapshot())')
+
+
+def test_settled_marker_is_rolled_up(rollup_db):
+    rollup_db.on('FOR UPDATE SKIP LOCKED', [(100, 300, '800')])
+    rollup_db.on('pg_sequence_last_value', [(700,)])
+    assert app.run_visit_rollup() == 50
+    [(_, settled)] = rollup_db.statements('pg_snapshot_xmin')
+    assert settled == ('800',)
+    inserts = rollup_db.statements('INSERT INTO')
+    assert [query.split()[2] for query, _ in inserts] == ['"visits_rollup_minute"', '"visits_rollup_hour"']
+    assert [params for _, params in inserts] == [('minute', 100, 300), ('hour', 100, 300)]
+    assert watermark_update(rollup_db) == (300, 700, '900')  # and a new marker
+    assert rollup_db.connection.commits == 1
+
+
+def test_unsettled_marker_waits(rollup_db):
+    rollup_db.on('FOR UPDATE SKIP LOCKED', [(100, 300, '800')])
+    rollup_db.on('pg_snapshot_xmin', [(False,)])
+    assert app.run_visit_rollup() == 0
+    assert rollup_db.statements('INSERT INTO') == []
+    assert rollup_db.statements('pg_sequence_last_value') == []
+    assert watermark_update(rollup_db) == (100, 300, '800')
+
+
+def test_a_full_batch_continues_next_run(rollup_db, monkeypatch):
+    monkeypatch.setattr(app, 'ROLLUP_BATCH_SIZE', 50)
+    rollup_db.on('FOR UPDATE SKIP LOCKED', [(100, 300, '800')])
+    rollup_db.on('SELECT COUNT(*), MAX(id)', [(50, 180)])
+    app.run_visit_rollup()
+    assert watermark_update(rollup_db) == (180, 300, '800')  # marker not used up yet
+
+
+def test_skips_when_another_worker_is_rolling_up(rollup_db):
+    rollup_db.on('FOR UPDATE SKIP LOCKED', [])
+    assert app.run_visit_rollup() == 0
+    assert rollup_db.statements('UPDATE rollup_watermarks') == []
+    assert rollup_db.connection.rollbacks == 1
+
+
+def test_reset(fake_db):
+    app.reset_visit_rollups(fake_db.connection.cursor())
+    assert fake_db.statements('TRUNCATE')[0][0] == 'TRUNCATE "visits_rollup_minute", "visits_rollup_hour"'
+    assert 'pending_xmax = NULL' in fake_db.statements('UPDATE rollup_watermarks')[0][0]
+
+
+def test_visit_inserts_take_a_transaction_id_first(fake_db):
+    recorder = app.VisitRecorder(batch_size=100, flush_interval=3600, max_buffer=10)
+    try:
+        recorder.record('/')
+        recorder.flush()
+    finally:
+        recorder.stopping = True
+        recorder.wakeup.set()
+    statements = [query for query, _ in fake_db.queries]
+    assert statements[0] == 'SELECT pg_current_xact_id()'
+    assert 'INSERT INTO visits' in statements[1]
+
+
+def test_analytics_reads_the_rollup_table(fake_db, client):
+    fake_db.on('FROM "visits_rollup_hour"', [(datetime.datetime(2025, 1, 1, 10), '/api/users', 7)])
+    fake_db.on('FROM rollup_watermarks', [(42, datetime.datetime(2025, 1, 1, 10, 30))])
+    response = client.get('/api/analytics/visits?granularity=hour&start=2025-01-01T00:00&end=2025-01-02T00:00'
+                          '&endpoint=/api/users')
+    data = response.get_json()
+    assert data['points'] == [{'bucket': '2025-01-01T10:00:00', 'endpoint': '/api/users', 'count': 7}]
+    assert data['rolled_up_until'] == '2025-01-01T10:30:00'
+    [(query, params)] = fake_db.statements('visits_rollup_hour')
+    assert 'AND endpoint = %s' in query and params[2] == '/api/users'
+
+
+@pytest.mark.parametrize('query', [
+    'granularity=day',
+    'start=yesterday',
+    'start=2025-01-02T00:00&end=2025-01-01T00:00',
+    'granularity=minute&start=2020-01-01T00:00&end=2025-01-01T00:00',
+])
+def test_analytics_bad_parameters(fake_db, client, query):
+    assert client.get(f'/api/analytics/visits?{query}').status_code == 400
@@ -0,0 +1,123 @@
+"""
+Tests for SingleFlight (see SINGLE-FLIGHT in app.py)
+
+Threads start a call while another one with the same key is running.
+Events make the order deterministic - no sleeps that "should be enough".
+"""
+
+import threading
+
+import app
+
+
+class WatchedEvent(threading.Event):
+    """An Event that tells us when somebody starts waiting on it"""
+
+    def __init__(self):
+        super().__init__()
+        self.waiter_joined = threading.Event()
+
+    def wait(self, timeout=None):
+        self.waiter_joined.set()
+        return super().wait(timeout)
+
+
+class WatchedCall(app.SingleFlight.Call):
+    def __init__(self):
+        super().__init__()
+        self.done = WatchedEvent()
+
+
+def make_flight(timeout):
+    flight = app.SingleFlight('test', timeout=timeout)
+    flight.Call = WatchedCall
+    return flight
+
+
+def start(target):
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread
+
+
+def wait_for_leader(flight, key):
+    while key not in flight.calls:
+        threading.Event().wait(0.001)
+    return flight.calls[key]
+
+
+def test_waiters_share_the_leaders_result():
+    flight = make_flight(timeout=5)
+    release = threading.Event()
+    calls = []
+    results = {}
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return 'users'
+
+    leader = start(lambda: results.setdefault('leader', flight.do('key', slow)))
+    call = wait_for_leader(flight, 'key')
+    waiter = start(lambda: results.setdefault('waiter', flight.do('key', slow)))
+    assert call.done.waiter_joined.wait(5)
+    release.set()
+    leader.join()
+    waiter.join()
+
+    assert len(calls) == 1
+    assert results == {'leader': ('users', False), 'waiter': ('users', True)}
+    assert flight.stats() == {'in_flight': 0, 'leaders': 1, 'shared': 1, 'timeouts': 0}
+
+
+def test_waiters_get_the_leaders_exception():
+    flight = make_flight(timeout=5)
+    release = threading.Event()
+    errors = []
+
+    def failing():
+        release.wait(5)
+        raise RuntimeError('database down')
+
+    def call():
+        try:
+            flight.do('key', failing)
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = start(call)
+    in_flight = wait_for_leader(flight, 'key')
+    waiter = start(call)
+    assert in_flight.done.waiter_joined.wait(5)
+    release.set()
+    leader.join()
+    waiter.join()
+
+    assert len(errors) == 2 and errors[0] is errors[1]
+    assert flight.calls == {}  # a failed call does not block the key
+
+
+def test_waiter_runs_the_work_itself_after_the_timeout():
+    flight = make_flight(timeout=0.01)
+    release = threading.Event()
+    leader = start(lambda: flight.do('key', lambda: release.wait(5)))
+    wait_for_leader(flight, 'key')
+
+    assert flight.do('key', lambda: 'own result') == ('own result', False)
+    assert flight.stats()['timeouts'] == 1
+    release.set()
+    leader.join()
+
+
+def test_different_keys_do_not_wait_for_each_other():
+    flight = make_flight(timeout=5)
+    assert flight.do('a', lambda: 1) == (1, False)
+    assert flight.do('b', lambda: 2) == (2, False)
+    assert flight.stats()['leaders'] == 2
+
+
+def test_single_flight_groups_are_created_once():
+    group = app.single_flight('test-group')
+    assert app.single_flight('test-group') is group
+    assert group.timeout == app.SINGLE_FLIGHT_TIMEOUT
+    app.single_flights.pop('test-group')
@@ -0,0 +1,65 @@
+"""
+Tests for Accept-Encoding parsing and StaticResponse (see STATIC RESPONSES in app.py)
+"""
+
+import gzip
+
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, {}),
+    ('', {}),
+    ('gzip', {'gzip': 1.0}),
+    ('gzip, deflate, br', {'gzip': 1.0, 'deflate': 1.0, 'br': 1.0}),
+    ('br;q=0.5, GZIP;q=1.0', {'br': 0.5, 'gzip': 1.0}),
+    ('gzip;q=0, identity', {'gzip': 0.0, 'identity': 1.0}),
+    ('gzip;q=abc', {'gzip': 0.0}),  # nonsense quality = not accepted
+    (' , gzip ,', {'gzip': 1.0}),
+])
+def test_parse_accept_encoding(header, expected):
+    assert app.parse_accept_encoding(header) == expected
+
+
+def test_static_response_is_built_once_per_ttl_and_compressed():
+    builds = []
+    body = b'{"hello": "world"}' * 50
+
+    def build():
+        builds.append(1)
+        return body
+
+    static = app.StaticResponse(build, 'application/json', ttl=60)
+    gzipped, etag, encoding = static.select('gzip')
+    assert encoding == 'gzip'
+    assert gzip.decompress(gzipped) == body
+    assert static.select('identity') == (body, etag.replace('-gzip', ''), None)
+    assert len(builds) == 1
+
+
+def test_static_response_is_rebuilt_after_its_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(app.time, 'monotonic', lambda: now[0])
+    bodies = iter([b'first', b'second'])
+    static = app.StaticResponse(lambda: next(bodies), 'text/plain', ttl=1)
+    assert static.select(None)[0] == b'first'
+    now[0] += 0.5
+    assert static.select(None)[0] == b'first'
+    now[0] += 0.6
+    assert static.select(None)[0] == b'second'
+    assert static.cache_control() == 'public, max-age=1'
+
+
+@pytest.mark.parametrize('url, name, payload', [
+    ('/api/info', 'info_response', app.info_payload),
+    ('/api/hello', 'hello_response', app.hello_payload),
+])
+def test_json_responses_keep_their_timestamp(client, monkeypatch, url, name, payload):
+    static = app.StaticResponse(lambda: app.app.json.response(payload()).get_data(), 'application/json', ttl=60)
+    monkeypatch.setattr(app, name, static)
+    response = client.get(url)
+    assert 'timestamp' in response.get_json()
+    assert response.headers['Cache-Control'] == 'public, max-age=60'
+    assert client.get(url, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
@@ -0,0 +1,109 @@
+"""
+Tests for /api/stats and its stale-while-revalidate cache (see STATISTICS in app.py)
+"""
+
+import datetime
+
+import psycopg2.errors
+import pytest
+
+import app
+
+RECENT = [{'endpoint': '/api/users', 'visited_at': datetime.datetime(2024, 5, 1, 12, 0)}]
+
+
+@pytest.fixture
+def stats_db(fake_db):
+    app.stats_cache.clear()
+    fake_db.on('FROM table_counters', [{'name': 'users', 'value': 3}, {'name': 'visits', 'value': 40}])
+    fake_db.on('FROM visits ORDER BY visited_at DESC', RECENT)
+    yield fake_db
+    app.stats_cache.clear()
+
+
+def test_totals_come_from_the_counters(stats_db, client):
+    data = client.get('/api/stats').get_json()
+    assert data['users'] == {'total': 3}
+    assert data['visits']['total'] == 40
+    assert data['visits']['recent'][0]['endpoint'] == '/api/users'
+    assert data['freshness']['stale'] is False
+    assert stats_db.statements('COUNT(*)') == []
+
+
+def test_missing_counter_falls_back_to_count(stats_db, client):
+    stats_db.on('FROM table_counters', [{'name': 'users', 'value': 3}])
+    stats_db.on('SELECT COUNT(*)', [{'count': 41}])
+    assert client.get('/api/stats').get_json()['visits']['total'] == 41
+
+
+def test_before_the_migrations_ran(stats_db, client):
+    stats_db.on('FROM table_counters', psycopg2.errors.UndefinedTable('relation "table_counters" does not exist'))
+    stats_db.on('SELECT COUNT(*)', [{'count': 5}])
+    response = client.get('/api/stats')
+    assert response.status_code == 200
+    assert response.get_json()['users'] == {'total': 5}
+    assert stats_db.connection.rollbacks == 1  # the failed statement aborted the transaction
+
+
+def test_second_request_is_served_from_the_cache(stats_db, client):
+    client.get('/api/stats')
+    client.get('/api/stats')
+    assert len(stats_db.statements('FROM table_counters')) == 1
+
+
+def test_database_not_available(stats_db, client):
+    stats_db.available = False
+    response = client.get('/api/stats')
+    assert response.status_code == 503
+    assert response.get_json()['database_connected'] is False
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ThreadLog:
+    """Stands in for threading.Thread and only remembers what would have run"""
+
+    started = []
+
+    def __init__(self, target, daemon):
+        self.target = target
+
+    def start(self):
+        ThreadLog.started.append(self.target)
+
+
+def test_stale_while_revalidate(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(app.time, 'monotonic', clock)
+    monkeypatch.setattr(app.threading, 'Thread', ThreadLog)
+    monkeypatch.setattr(ThreadLog, 'started', [])
+    loads = []
+    cache = app.StaleWhileRevalidateCache(lambda: loads.append(1) or len(loads), ttl=5, stale_ttl=60,
+                                          name='test-swr')
+
+    value, _, age, stale = cache.get()
+    assert (value, stale) == (1, False)
+    clock.now += 10
+    value, _, age, stale = cache.get()
+    assert (value, age, stale) == (1, 10, True)              # old value at once...
+    assert ThreadLog.started == [cache._refresh_in_background]  # ...and a reload in the background
+    cache.get()
+    assert len(ThreadLog.started) == 1                       # only one reload at a time
+    clock.now += 100
+    value, _, age, stale = cache.get()
+    assert (value, stale) == (2, False)                      # too old: wait for a fresh load
+
+
+def test_a_bumped_namespace_makes_the_value_stale(fake_db, monkeypatch):
+    cache = app.StaleWhileRevalidateCache(lambda: 'numbers', ttl=5, stale_ttl=60, name='test-swr',
+                                          namespace='stats')
+    monkeypatch.setattr(cache, '_refresh_in_background', lambda: None)
+    assert cache.get()[3] is False
+    app.response_cache.bump('stats')
+    assert cache.get()[3] is True
@@ -0,0 +1,129 @@
+"""
+Tests for the live stats stream (see LIVE STATS STREAM in app.py and asgi.py)
+
+The producer thread is never started: _collect() and _run() are called
+directly, with time.sleep() made instant.
+"""
+
+import asyncio
+import datetime
+import json
+
+import pytest
+
+import app
+import asgi
+
+VISITED = datetime.datetime(2025, 1, 31, 10, 0, 0)
+
+
+class NoThread:
+    """Stands in for threading.Thread: the producer is driven by the test"""
+
+    def __init__(self, target, name=None, daemon=None):
+        self.target = target
+
+    def start(self):
+        pass
+
+
+@pytest.fixture
+def broadcaster(fake_db, monkeypatch):
+    monkeypatch.setattr(app.threading, 'Thread', NoThread)
+    broadcaster = app.StreamBroadcaster(interval=0)
+    monkeypatch.setattr(app, 'stream_broadcaster', broadcaster)
+    return broadcaster
+
+
+def events(messages):
+    """'event: x\ndata: {...}\n' messages -> [(x, {...})]"""
+    parsed = []
+    for message in messages:
+        event, data = message.strip().split('\n')
+        parsed.append((event.removeprefix('event: '), json.loads(data.removeprefix('data: '))))
+    return parsed
+
+
+def test_subscriber_disconnects_when_its_queue_is_full():
+    subscriber = app.StreamSubscriber(size=2)
+    assert subscriber.deliver('a') and subscriber.deliver('b')
+    assert not subscriber.deliver('c')
+    assert subscriber.closed
+
+
+def test_heartbeat_when_nothing_happens():
+    subscriber = app.StreamSubscriber(size=2)
+    subscriber.deliver('hello')
+    messages = subscriber.messages(heartbeat=0.01)
+    assert next(messages) == 'hello'
+    assert next(messages) == ': heartbeat\n\n'
+
+
+def test_collect_sends_only_changes(broadcaster, fake_db):
+    fake_db.on('FROM table_counters', [('users', 3), ('visits', 40)])
+    fake_db.on('COALESCE(MAX(id), 0) FROM visits', [(10,)])
+    assert events(broadcaster._collect()) == [('totals', {'totals': {'users': 3, 'visits': 40}, 'change': None})]
+    assert broadcaster.last_visit_id == 10
+
+    fake_db.on('FROM table_counters', [('users', 4), ('visits', 42)])
+    fake_db.on('SELECT id, endpoint, visited_at FROM visits', [(12, '/api/users', VISITED), (11, '/', VISITED)])
+    assert events(broadcaster._collect()) == [
+        ('totals', {'totals': {'users': 4, 'visits': 42}, 'change': {'users': 1, 'visits': 2}}),
+        ('visits', {'visits': [  # oldest first
+            {'id': 11, 'endpoint': '/', 'visited_at': VISITED.isoformat()},
+            {'id': 12, 'endpoint': '/api/users', 'visited_at': VISITED.isoformat()},
+        ]}),
+    ]
+    [(_, params)] = fake_db.statements('WHERE id > %s')
+    assert params == (10, app.STREAM_VISITS_PER_EVENT)
+
+    fake_db.on('SELECT id, endpoint, visited_at FROM visits', [])
+    assert broadcaster._collect() == []  # nothing changed, nothing sent
+
+
+def test_too_slow_subscribers_are_dropped(broadcaster, monkeypatch):
+    monkeypatch.setattr(app.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(broadcaster, '_collect', lambda: ['one', 'two'])
+    fast, slow = app.StreamSubscriber(size=10), app.StreamSubscriber(size=1)
+    assert broadcaster.subscribe(fast, 5) and broadcaster.subscribe(slow, 5)
+    monkeypatch.setattr(fast, 'deliver', lambda message: broadcaster.unsubscribe(fast) or True)  # leaves after one
+    broadcaster._run()  # returns once nobody is subscribed
+    assert slow.closed
+    assert broadcaster.stats() == {'subscribers': 0, 'pushes': 1, 'disconnected_too_slow': 1, 'errors': 0}
+    assert broadcaster.thread is None  # the next subscriber starts a new producer
+
+
+def test_subscriber_limit(broadcaster):
+    assert broadcaster.subscribe(app.StreamSubscriber(1), max_clients=1)
+    assert not broadcaster.subscribe(app.StreamSubscriber(1), max_clients=1)
+
+
+def test_stream_starts_with_a_snapshot(broadcaster, fake_db, client):
+    app.stats_cache.clear()
+    try:
+        fake_db.on('FROM table_counters', [{'name': 'users', 'value': 3}, {'name': 'visits', 'value': 40}])
+        response = client.get('/api/stats/stream', environ_overrides={'wsgi.multithread': True})
+        assert response.mimetype == 'text/event-stream'
+        first = next(response.response).decode()
+        assert first.startswith(f'retry: {app.STREAM_RETRY_MS}\n\nevent: stats\n')
+        assert broadcaster.stats()['subscribers'] == 1
+        response.close()
+        assert broadcaster.stats()['subscribers'] == 0
+    finally:
+        app.stats_cache.clear()
+
+
+def test_single_threaded_workers_cannot_stream(broadcaster, client):
+    response = client.get('/api/stats/stream', environ_overrides={'wsgi.multithread': False})
+    assert response.status_code == 503
+
+
+def test_async_subscriber_bound_is_enforced_on_the_event_loop():
+    async def run():
+        subscriber = asgi.AsyncStreamSubscriber(size=1)
+        assert subscriber.deliver('a') and subscriber.deliver('b')
+        await asyncio.sleep(0)  # let the loop run the queued puts
+        assert subscriber.closed
+        return [message async for message in subscriber.messages(heartbeat=1)]
+
+    assert asyncio.run(run()) == []
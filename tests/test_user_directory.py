@@ -0,0 +1,124 @@
+"""
+Tests for the in-memory user directory (see USER DIRECTORY in app.py)
+
+Changes are fed in as the JSON payloads the users_changed NOTIFY sends,
+so no database is needed.
+"""
+
+import datetime
+import json
+import os
+
+import pytest
+
+import app
+
+CREATED = datetime.datetime(2024, 5, 1, 12, 0, 0, 123456)
+FIELDS = ('id', 'name', 'email', 'created_at')
+
+
+def upsert(user_id, name, email, created_at=CREATED.isoformat()):
+    return json.dumps({'op': 'upsert', 'id': user_id, 'name': name,
+                       'email': email, 'created_at': created_at})
+
+
+def delete(user_id):
+    return json.dumps({'op': 'delete', 'id': user_id})
+
+
+@pytest.fixture
+def directory():
+    users = app.UserDirectory(max_users=3, enabled=True)
+    # As if _load() had just run in this process
+    users.state = 'ready'
+    users.pid = os.getpid()
+    return users
+
+
+def test_upserts_keep_the_users_sorted_by_id(directory):
+    directory._apply([upsert(5, 'Eve', 'eve@example.com'), upsert(2, 'Bob', 'bob@example.com')])
+    assert list(directory.ids) == [2, 5]
+    assert directory.page(0, 10, ('id',)) == [{'id': 2}, {'id': 5}]
+    assert directory.page(2, 10, ('id', 'name')) == [{'id': 5, 'name': 'Eve'}]
+    assert directory.changes == 2
+
+
+def test_created_at_is_exact(directory):
+    directory._apply([upsert(1, 'Ann', 'ann@example.com')])
+    assert directory.find('id', 1, FIELDS)['created_at'] == CREATED
+
+
+def test_created_at_in_microseconds_from_older_databases(directory):
+    micros = app.to_microseconds(CREATED)
+    directory._apply([upsert(1, 'Ann', 'ann@example.com', created_at=micros)])
+    assert directory.find('id', 1, FIELDS)['created_at'] == CREATED
+    directory._apply([upsert(2, 'Bob', 'bob@example.com', created_at=None)])
+    assert directory.find('id', 2, FIELDS)['created_at'] is None
+
+
+def test_changed_email_moves_the_lookup(directory):
+    directory._apply([upsert(1, 'Ann', 'ann@example.com')])
+    directory._apply([upsert(1, 'Ann', 'ann@new.example.com')])
+    assert directory.find('email', 'ann@example.com', FIELDS) is None
+    assert directory.find('email', 'ann@new.example.com', ('id',)) == {'id': 1}
+    assert len(directory.ids) == 1
+
+
+def test_email_taken_over_by_another_user(directory):
+    # User 1 gives up the address, user 2 takes it - in one batch
+    directory._apply([upsert(1, 'Ann', 'shared@example.com'), upsert(2, 'Bob', 'bob@example.com')])
+    directory._apply([upsert(2, 'Bob', 'shared@example.com'), upsert(1, 'Ann', 'ann@example.com')])
+    assert directory.find('email', 'shared@example.com', ('id',)) == {'id': 2}
+    assert directory.find('email', 'ann@example.com', ('id',)) == {'id': 1}
+
+
+def test_delete(directory):
+    directory._apply([upsert(1, 'Ann', 'ann@example.com'), upsert(2, 'Bob', 'bob@example.com')])
+    directory._apply([delete(1), delete(99)])  # unknown ids are ignored
+    assert list(directory.ids) == [2]
+    assert directory.find('email', 'ann@example.com', FIELDS) is None
+
+
+def test_reload_stops_answering_from_memory(directory):
+    directory._apply([upsert(1, 'Ann', 'ann@example.com')])
+    assert directory._apply([json.dumps({'op': 'reload'}), upsert(2, 'Bob', 'bob@example.com')])
+    assert directory.state == 'loading'
+    assert directory.page(0, 10, ('id',)) is None  # None = ask the database
+    assert list(directory.ids) == [1]  # the rest of the batch waits for the reload
+
+
+def test_too_many_users(directory):
+    directory._apply([upsert(i, f'User {i}', f'user{i}@example.com') for i in (1, 2, 3)])
+    with pytest.raises(app.DirectoryFull):
+        directory._apply([upsert(4, 'User 4', 'user4@example.com')])
+    directory._apply([upsert(3, 'Renamed', 'user3@example.com')])  # updates still fit
+
+
+def test_not_ready_after_a_fork(directory, monkeypatch):
+    monkeypatch.setattr(app.os, 'getpid', lambda: directory.pid + 1)
+    assert directory.find('id', 1, FIELDS) is None
+
+
+@pytest.fixture
+def served_directory(directory, fake_db, monkeypatch):
+    directory._apply([upsert(1, 'Ann', 'ann@example.com'), upsert(2, 'Bob', 'bob@example.com')])
+    monkeypatch.setattr(app, 'user_directory', directory)
+    return directory
+
+
+def test_reads_are_answered_from_memory(served_directory, fake_db, client):
+    assert client.get('/api/users/2?fields=name').get_json() == {'user': {'id': 2, 'name': 'Bob'}}
+    assert client.get('/api/users/by-email?email=ann@example.com').get_json()['user']['id'] == 1
+    assert [user['id'] for user in client.get('/api/users?limit=1').get_json()['users']] == [1]
+    assert fake_db.queries == []
+    # Unknown ids still ask the database (the NOTIFY may not have arrived yet)
+    assert client.get('/api/users/9').status_code == 404
+    assert len(fake_db.statements('FROM users')) == 1
+
+
+def test_reads_work_while_the_database_circuit_is_open(served_directory, client, monkeypatch):
+    breaker = app.CircuitBreaker(open_seconds=60)
+    breaker._open('test')
+    monkeypatch.setattr(app, 'db_breaker', breaker)
+    assert client.get('/api/users/1').status_code == 200
+    assert client.get('/api/users/search?q=ann').status_code == 503  # not in memory
@@ -0,0 +1,77 @@
+"""
+Tests for GET /api/users/by-email and GET /api/users/search
+"""
+
+import pytest
+
+import app
+
+ANN = {'id': 1, 'name': 'Ann', 'email': 'ann@example.com', 'created_at': None}
+
+
+def test_by_email_uses_the_email_column(fake_db, client):
+    fake_db.on('FROM users', [ANN])
+    response = client.get('/api/users/by-email?email= ann@example.com &fields=name')
+    assert response.get_json() == {'user': ANN}
+    [(query, params)] = fake_db.statements('FROM users')
+    assert query == 'SELECT "id", "name" FROM users WHERE email = %s'
+    assert params == ('ann@example.com',)
+
+
+@pytest.mark.parametrize('url, status', [
+    ('/api/users/by-email', 400),
+    ('/api/users/by-email?email=ann@example.com&fields=password', 400),
+    ('/api/users/by-email?email=nobody@example.com', 404),
+])
+def test_by_email_errors(fake_db, client, url, status):
+    assert client.get(url).status_code == status
+
+
+def test_prefix_search(fake_db, client):
+    fake_db.on('FROM users', [ANN])
+    data = client.get('/api/users/search?q=AN').get_json()
+    assert data['query'] == 'an' and data['mode'] == 'prefix'
+    assert data['users'] == [ANN] and data['next_cursor'] is None
+    [(query, params)] = fake_db.statements('FROM users')
+    assert 'lower(name) LIKE %s AND id > %s ORDER BY id LIMIT %s' in query
+    assert params == ('an%', 0, app.USERS_PAGE_SIZE + 1)
+
+
+def test_contains_search_pages_with_the_id_cursor(fake_db, client):
+    fake_db.on('FROM users', [{'id': 4, 'name': 'Joanna'}, {'id': 9, 'name': 'Johanna'}])
+    data = client.get('/api/users/search?q=ann&mode=contains&limit=1&after_id=3&fields=name').get_json()
+    assert data['users'] == [{'id': 4, 'name': 'Joanna'}]
+    assert data['next_cursor'] == 4
+    [(_, params)] = fake_db.statements('FROM users')
+    assert params == ('%ann%', 3, 2)
+
+
+def test_wildcards_in_the_search_text_match_literally(fake_db, client):
+    client.get('/api/users/search?q=100%25_off')
+    [(_, params)] = fake_db.statements('FROM users')
+    assert params[0] == '100\\%\\_off%'
+
+
+def test_escape_like():
+    assert app.escape_like('a%b_c\\d') == 'a\\%b\\_c\\\\d'
+    assert app.escape_like('plain') == 'plain'
+
+
+@pytest.mark.parametrize('query, error', [
+    ('', "'q' is required"),
+    ('q=jo&mode=fuzzy', "'mode' must be prefix or contains"),
+    ('q=jo&mode=contains', "'q' must be at least 3 characters for mode=contains"),
+    ('q=jo&limit=0', "'limit' must be >= 1"),
+])
+def test_search_errors(fake_db, client, query, error):
+    response = client.get(f'/api/users/search?{query}')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == error
+    assert fake_db.queries == []
+
+
+def test_search_without_a_database(fake_db, client):
+    fake_db.available = False
+    response = client.get('/api/users/search?q=jo')
+    assert response.status_code == 503
+    assert response.get_json()['users'] == []
@@ -0,0 +1,98 @@
+"""
+Tests for VisitRecorder (see VISIT TRACKING in app.py)
+
+The recorder's background thread waits an hour between flushes here, so
+the tests decide when flush() runs.
+"""
+
+import time
+
+import psycopg2.errors
+import pytest
+
+import app
+
+
+@pytest.fixture
+def recorder(fake_db):
+    visits = app.VisitRecorder(batch_size=100, flush_interval=3600, max_buffer=3)
+    yield visits
+    visits.stopping = True
+    visits.wakeup.set()
+
+
+def inserts(fake_db):
+    return fake_db.statements('INSERT INTO visits')
+
+
+def test_one_insert_and_commit_per_batch(recorder, fake_db):
+    recorder.record('/api/users')
+    recorder.record('/api/stats')
+    assert inserts(fake_db) == []  # nothing written on the request path
+    assert recorder.flush() == 2
+    [(query, (endpoints, moments))] = inserts(fake_db)
+    assert 'unnest' in query
+    assert endpoints == ['/api/users', '/api/stats']
+    assert len(moments) == 2
+    assert fake_db.connection.commits == 1
+    assert recorder.stats()['flushed'] == 2
+    assert recorder.flush() == 0  # empty buffer = no database work
+
+
+def test_full_buffer_drops_new_visits(recorder):
+    for _ in range(5):
+        recorder.record('/')
+    stats = recorder.stats()
+    assert stats['buffered'] == 3 and stats['dropped'] == 2
+
+
+def test_a_full_batch_wakes_the_writer(fake_db):
+    recorder = app.VisitRecorder(batch_size=2, flush_interval=3600, max_buffer=100)
+    recorder.record('/')
+    recorder.record('/')
+    for _ in range(500):
+        if recorder.stats()['flushed'] == 2:
+            break
+        time.sleep(0.01)
+    recorder.stop()
+    assert recorder.stats()['flushed'] == 2
+
+
+def test_visits_are_counted_as_failed_without_a_database(recorder, fake_db):
+    fake_db.available = False
+    recorder.record('/')
+    assert recorder.flush() == 0
+    assert recorder.stats()['failed'] == 1
+
+
+def test_missing_partition_is_created_and_the_insert_retried(recorder, fake_db):
+    attempts = []
+
+    def insert(params):
+        attempts.append(params)
+        if len(attempts) == 1:
+            return psycopg2.errors.CheckViolation('no partition of relation "visits" found for row')
+        return []
+
+    fake_db.on('INSERT INTO visits', insert)
+    recorder.record('/')
+    assert recorder.flush() == 1
+    assert len(attempts) == 2
+    assert fake_db.statements('PARTITION OF visits')
+    assert fake_db.connection.rollbacks >= 1
+
+
+def test_stop_writes_what_is_left(recorder, fake_db):
+    recorder.record('/')
+    recorder.stop()
+    assert len(inserts(fake_db)) == 1
+
+
+def test_requests_record_the_route_pattern(fake_db, client, monkeypatch):
+    recorded = []
+    monkeypatch.setattr(app.visit_recorder, 'record', recorded.append)
+    monkeypatch.setattr(app, 'VISITS_SKIP_ENDPOINTS', {'/health'})
+    fake_db.on('FROM users', [{'id': 7, 'name': 'Ann', 'email': 'a@example.com', 'created_at': None}])
+    client.get('/api/users/7')
+    client.get('/health')
+    assert recorded == ['/api/users/<int:user_id>']